@@ -1,8 +1,12 @@
 from pylons import config, request, tmpl_context as c
 
+from repoze.what.plugins.pylonshq import ActionProtector
+
+from adhocracy.lib.auth.authorization import has_permission
 from adhocracy.lib.base import BaseController
+from adhocracy.lib.cache.util import cache_stats
 from adhocracy.lib.helpers import json_loads
-from adhocracy.lib.templating import render
+from adhocracy.lib.templating import render, render_json
 from adhocracy.model.meta import engine
 
 
@@ -37,3 +41,11 @@ class DebugController(BaseController):
         c.duration = float(request.params['duration'])
 
         return render('/debug/explain.html')
+
+    @ActionProtector(has_permission("global.admin"))
+    def cache(self):
+        '''
+        Hit, miss and set counts, compute times and value sizes of the
+        memoized functions in this process as JSON.
+        '''
+        return render_json(cache_stats())
@@ -72,16 +72,26 @@ class PollController(BaseController):
             abort(400, _("This is not an adoption poll."))
         require.poll.vote(c.poll)
         decision = democracy.Decision(c.user, c.poll)
-        votes = decision.make(self.form_result.get("position"))
-
-        for vote in votes:
-            event.emit(event.T_VOTE_CAST, vote.user, instance=c.instance,
-                       topics=[c.poll.scope], vote=vote, poll=c.poll)
-        model.meta.Session.commit()
+        position = self.form_result.get("position")
+
+        if democracy.is_async_propagation():
+            old = decision.result
+            votes = decision.make(position, propagate=False)
+            model.meta.Session.commit()
+            democracy.post_propagation(votes[0], event.T_VOTE_CAST)
+            score = democracy.provisional_tally(c.poll, old,
+                                                decision.result).score
+        else:
+            votes = decision.make(position, bulk=True)
+            event.emit_many(event.T_VOTE_CAST,
+                            [(v.user, dict(vote=v, poll=c.poll))
+                             for v in votes],
+                            instance=c.instance, topics=[c.poll.scope])
+            score = c.poll.tally.score
 
         if format == 'json':
             return render_json(dict(decision=decision,
-                                    score=c.poll.tally.score))
+                                    score=score))
 
         redirect(h.entity_url(c.poll.subject))
 
@@ -108,15 +118,22 @@ class PollController(BaseController):
                      (model.Vote.ABSTAIN, model.Vote.NO): model.Vote.NO,
                      (model.Vote.NO, model.Vote.NO): model.Vote.NO}
         position = positions.get((old, new), new)
-        votes = decision.make(position)
-        tally = model.Tally.create_from_poll(c.poll)
         event_type = {model.Poll.RATE: event.T_RATING_CAST,
                       model.Poll.SELECT: event.T_SELECT_VARIANT
                       }.get(c.poll.action)
-        for vote in votes:
-            event.emit(event_type, vote.user, instance=c.instance,
-                       topics=[c.poll.scope], vote=vote, poll=c.poll)
-        model.meta.Session.commit()
+
+        if democracy.is_async_propagation():
+            votes = decision.make(position, propagate=False)
+            model.meta.Session.commit()
+            democracy.post_propagation(votes[0], event_type)
+            tally = democracy.provisional_tally(c.poll, old, decision.result)
+        else:
+            votes = decision.make(position, bulk=True)
+            tally = model.Tally.create_from_poll(c.poll)
+            event.emit_many(event_type,
+                            [(v.user, dict(vote=v, poll=c.poll))
+                             for v in votes],
+                            instance=c.instance, topics=[c.poll.scope])
 
         if format == 'json':
             return render_json(dict(decision=decision,
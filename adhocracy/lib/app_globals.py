@@ -1,9 +1,10 @@
 """The application's Globals object"""
 import logging
 
+from paste.deploy.converters import asbool
 from pylons import config
 
-import memcache
+from adhocracy.lib.cache import backends
 
 
 log = logging.getLogger(__name__)
@@ -22,14 +23,15 @@ class Globals(object):
         'app_globals' variable
 
         """
-        if 'memcached.server' in config:
-            self.cache = memcache.Client([config['memcached.server']])
-            log.info("Memcache set up")
-            log.debug("Flushing cache")
-            self.cache.flush_all()
+        self.cache = backends.from_config(config)
+        if self.cache is None:
+            log.warn("No cache backend, no results caching will take place.")
         else:
-            log.warn("Skipped memcache, no results caching will take place.")
-            self.cache = None
+            log.info("Cache set up: %s" % self.cache.__class__.__name__)
+            if asbool(config.get('adhocracy.cache.flush_on_startup',
+                                 False)):
+                log.debug("Flushing cache")
+                self.cache.flush_all()
 
         if 'adhocracy.instance' in config:
             self.single_instance = config.get('adhocracy.instance')
@@ -14,6 +14,8 @@ from sqlalchemy.orm.exc import DetachedInstanceError
 
 from adhocracy import i18n, model
 from adhocracy.lib import helpers as h
+from adhocracy.lib.cache import util as cache_util
+from adhocracy.lib.search import index as search_index
 from adhocracy.lib.templating import ret_abort
 
 log = logging.getLogger(__name__)
@@ -59,6 +61,7 @@ class BaseController(WSGIController):
                      "democracy, wiki, voting,participation, group decisions, "
                      "decisions, decision-making"))
 
+        cache_util.begin_request()
         try:
             return WSGIController.__call__(self, environ, start_response)
         except Exception, e:
@@ -66,6 +69,8 @@ class BaseController(WSGIController):
             model.meta.Session.rollback()
             raise
         finally:
+            cache_util.end_request()
+            search_index.release_connection()
             if isinstance(model.meta.Session, ScopedSession):
                 model.meta.Session.remove()
 
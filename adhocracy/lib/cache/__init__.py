@@ -2,7 +2,7 @@ import logging
 
 import adhocracy.model as model
 
-from util import memoize
+from util import memoize, batch_invalidation
 from invalidate import (invalidate_user, invalidate_vote, invalidate_page,
                         invalidate_delegateable, invalidate_delegation,
                         invalidate_revision, invalidate_comment,
@@ -0,0 +1,297 @@
+"""
+Backends for ``app_globals.cache``. All of them implement the subset of
+the ``memcache.Client`` API that :mod:`adhocracy.lib.cache` relies on:
+``get``, ``set``, ``add``, ``incr``, ``delete``, ``get_multi``,
+``set_multi``, ``delete_multi`` and ``flush_all``.
+
+The backend is chosen with ``adhocracy.cache.backend``:
+
+``memcached``
+  A memcached server configured with ``memcached.server``. This is the
+  default if ``memcached.server`` is set.
+``memory``
+  A bounded dict in each process (``adhocracy.cache.memory_size``).
+  Tag invalidations are not seen by other processes, so use it only
+  with a single process.
+``file``
+  Pickle files in ``adhocracy.cache.file_dir``, shared by all processes
+  of a single node. At most ``adhocracy.cache.file_max_entries`` files
+  are kept.
+``none``
+  No caching at all. This is the default without ``memcached.server``.
+"""
+from contextlib import contextmanager
+import cPickle
+import errno
+import fcntl
+from hashlib import sha1
+import logging
+import os
+from tempfile import mkstemp
+from time import time as now
+
+from adhocracy.lib.cache.local import LRUCache
+
+log = logging.getLogger(__name__)
+
+
+class CacheBackend(object):
+    """
+    Base class for cache backends. Subclasses implement ``get``, ``set``,
+    ``add``, ``incr``, ``delete`` and ``flush_all``; the multi
+    operations fall back to calling them for every key.
+    """
+
+    def get(self, key):
+        raise NotImplementedError()
+
+    def set(self, key, value, time=0):
+        raise NotImplementedError()
+
+    def add(self, key, value, time=0):
+        raise NotImplementedError()
+
+    def incr(self, key, delta=1):
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+    def flush_all(self):
+        raise NotImplementedError()
+
+    def get_multi(self, keys):
+        result = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                result[key] = value
+        return result
+
+    def set_multi(self, mapping, time=0):
+        """ Returns the keys that could not be stored. """
+        return [key for (key, value) in mapping.items()
+                if not self.set(key, value, time=time)]
+
+    def delete_multi(self, keys):
+        for key in keys:
+            self.delete(key)
+        return True
+
+
+class MemcacheBackend(CacheBackend):
+
+    def __init__(self, servers):
+        import memcache
+        self.client = memcache.Client(servers)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, time=0):
+        return self.client.set(key, value, time=time)
+
+    def add(self, key, value, time=0):
+        return self.client.add(key, value, time=time)
+
+    def incr(self, key, delta=1):
+        return self.client.incr(key, delta)
+
+    def delete(self, key):
+        return self.client.delete(key)
+
+    def flush_all(self):
+        self.client.flush_all()
+
+    def get_multi(self, keys):
+        return self.client.get_multi(keys)
+
+    def set_multi(self, mapping, time=0):
+        return self.client.set_multi(mapping, time=time)
+
+    def delete_multi(self, keys):
+        return self.client.delete_multi(keys)
+
+
+class MemoryBackend(LRUCache, CacheBackend):
+    """
+    A :class:`~adhocracy.lib.cache.local.LRUCache` with the remaining
+    operations of the backend API.
+    """
+
+    def add(self, key, value, time=0):
+        with self._lock:
+            if self.get(key) is not None:
+                return False
+            return self.set(key, value, time=time)
+
+    def incr(self, key, delta=1):
+        with self._lock:
+            entry = self._data.get(key)
+            value = self.get(key)
+            if value is None:
+                return None
+            value += delta
+            self._data[key] = (value, entry[1])
+            return value
+
+
+class FileBackend(CacheBackend):
+    """
+    Stores every value pickled in a file named after the hashed key.
+    Writes replace files atomically, ``add`` and ``incr`` are serialized
+    across processes with a lock file.
+
+    Every ``sweep_interval`` writes of a process, expired files are
+    deleted, and the oldest files above ``max_entries`` are deleted too.
+    Keys that are never set again, like those of old tag generations,
+    would otherwise stay forever.
+
+    :param path: The directory to store the files in.
+    """
+
+    def __init__(self, path, max_entries=10000, sweep_interval=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self._writes = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._lock_path = os.path.join(path, 'lock')
+
+    def _file(self, key):
+        return os.path.join(self.path, sha1(key).hexdigest())
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self, path, value=True):
+        """
+        Read the expiry time and, if ``value`` is set, the value stored
+        in *path*. Expired entries are returned as ``(None, expires)``.
+        """
+        with open(path, 'rb') as f:
+            expires = cPickle.load(f)
+            if expires and expires < now():
+                return None, expires
+            if not value:
+                return None, expires
+            return cPickle.load(f), expires
+
+    def _read(self, key):
+        try:
+            value, expires = self._load(self._file(key))
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                log.warn("Cannot read cache file for %s: %s" % (key, e))
+            return None, None
+        except (EOFError, TypeError, cPickle.UnpicklingError):
+            return None, None
+        if value is None:
+            return None, None
+        return value, expires
+
+    def _write(self, key, value, expires):
+        fd, tmp = mkstemp(dir=self.path, prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            cPickle.dump(expires, f, cPickle.HIGHEST_PROTOCOL)
+            cPickle.dump(value, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self._file(key))
+        self._writes += 1
+        if self._writes % self.sweep_interval == 0:
+            self.sweep()
+        return True
+
+    def _entries(self):
+        # skips the lock file and temporary files of unfinished writes
+        return [os.path.join(self.path, name)
+                for name in os.listdir(self.path)
+                if not (name == 'lock' or name.startswith('.'))]
+
+    def sweep(self):
+        """
+        Delete expired files and the oldest files above ``max_entries``.
+        """
+        current = now()
+        entries = []
+        for path in self._entries():
+            try:
+                expires = self._load(path, value=False)[1]
+                if expires and expires < current:
+                    os.unlink(path)
+                else:
+                    entries.append((os.stat(path).st_mtime, path))
+            except (IOError, OSError, EOFError, TypeError,
+                    cPickle.UnpicklingError):
+                # deleted by another process, or half written
+                continue
+        entries.sort()
+        for (mtime, path) in entries[:max(0, len(entries) -
+                                            self.max_entries)]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def get(self, key):
+        return self._read(key)[0]
+
+    def set(self, key, value, time=0):
+        return self._write(key, value, now() + time if time else None)
+
+    def add(self, key, value, time=0):
+        with self._locked():
+            if self.get(key) is not None:
+                return False
+            return self.set(key, value, time=time)
+
+    def incr(self, key, delta=1):
+        with self._locked():
+            value, expires = self._read(key)
+            if value is None:
+                return None
+            value += delta
+            self._write(key, value, expires)
+            return value
+
+    def delete(self, key):
+        try:
+            os.unlink(self._file(key))
+            return True
+        except OSError:
+            return False
+
+    def flush_all(self):
+        for path in self._entries():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def from_config(config):
+    """
+    Create the backend configured with ``adhocracy.cache.backend`` or
+    return None if caching is disabled.
+    """
+    default = 'memcached' if 'memcached.server' in config else 'none'
+    name = config.get('adhocracy.cache.backend', default)
+    if name == 'memcached':
+        return MemcacheBackend([config['memcached.server']])
+    elif name == 'memory':
+        return MemoryBackend(
+            int(config.get('adhocracy.cache.memory_size', 10000)))
+    elif name == 'file':
+        return FileBackend(
+            config.get('adhocracy.cache.file_dir',
+                       os.path.join(config['cache_dir'], 'memoize')),
+            int(config.get('adhocracy.cache.file_max_entries', 10000)))
+    elif name == 'none':
+        return None
+    raise ValueError("Unknown cache backend: %s" % name)
@@ -1,6 +1,6 @@
 import logging
 from adhocracy import model
-from adhocracy.lib.cache.util import clear_tag
+from adhocracy.lib.cache.util import batch_invalidation, clear_tag
 
 log = logging.getLogger(__name__)
 
@@ -34,7 +34,8 @@ def invalidate_page(page):
 
 
 def invalidate_delegateable(d):
-    clear_tag(d)
+    if not clear_tag(d):
+        return
     for p in d.parents:
         invalidate_delegateable(p)
     if not len(d.parents):
@@ -46,7 +47,8 @@ def invalidate_revision(rev):
 
 
 def invalidate_comment(comment):
-    clear_tag(comment)
+    if not clear_tag(comment):
+        return
     if comment.reply:
         invalidate_comment(comment.reply)
     invalidate_delegateable(comment.topic)
@@ -84,10 +86,10 @@ def invalidate_poll(poll):
 
 
 def invalidate_instance(instance):
-    # muharhar cache epic fail
-    clear_tag(instance)
-    for d in instance.delegateables:
-        invalidate_delegateable(d)
+    with batch_invalidation():
+        clear_tag(instance)
+        for d in instance.delegateables:
+            invalidate_delegateable(d)
 
 
 def invalidate_tagging(tagging):
@@ -0,0 +1,59 @@
+from collections import OrderedDict
+import logging
+from threading import RLock
+from time import time as now
+
+log = logging.getLogger(__name__)
+
+
+class LRUCache(object):
+    """
+    A bounded, thread safe in-process cache. The least recently used
+    entry is dropped when ``max_size`` is exceeded and entries expire
+    after ``ttl`` seconds (or the ``time`` given to ``set``, whatever
+    is shorter). A ``ttl`` of 0 means entries only leave the cache
+    when they are pushed out.
+
+    :param max_size: The maximum number of entries.
+    :param ttl: The default time to live in seconds.
+    """
+
+    def __init__(self, max_size=1000, ttl=0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = RLock()
+
+    def _expires(self, time):
+        ttls = [t for t in (self.ttl, time) if t]
+        return now() + min(ttls) if ttls else None
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < now():
+                return None
+            self._data[key] = entry
+            return value
+
+    def set(self, key, value, time=0):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, self._expires(time))
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def flush_all(self):
+        with self._lock:
+            self._data.clear()
+
+    def size(self):
+        return len(self._data)
@@ -1,66 +1,457 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import cPickle
 import logging
 from hashlib import sha1
+import threading
+from time import time as now
 
-from pylons import app_globals
+from pylons import app_globals, config
+
+from adhocracy.lib.cache.local import LRUCache
+from adhocracy.model import refs
 
 log = logging.getLogger(__name__)
 
-SEP = "|"
+GENERATION_PREFIX = "gen:"
+LOCK_PREFIX = "lock:"
+
+# iden -> {'request_hits': n, 'local_hits': n, 'hits': n,
+#          'stale_hits': n, 'misses': n, 'sets': n,
+#          'compute_time': seconds, 'bytes': n}
+COUNTERS = defaultdict(lambda: defaultdict(int))
+# {'clears': n, 'batched_clears': n}
+CLEAR_COUNTERS = defaultdict(int)
+
+_last_summary = now()
+
+_local = None
+_generations = None
+_request = threading.local()
 
 
 class NoneResult(object):
     pass
 
 
+class Entry(object):
+    """
+    A memoized value as it is stored in ``app_globals.cache``. After
+    ``expires`` the value should be recomputed, but it stays in the
+    cache for a grace period so it can be served while that happens.
+    """
+
+    def __init__(self, value, expires=None):
+        self.value = value
+        self.expires = expires
+
+    def is_stale(self):
+        return self.expires is not None and self.expires < now()
+
+
+def _entry(value):
+    # values stored before entries were introduced never go stale
+    if value is None or isinstance(value, Entry):
+        return value
+    return Entry(value)
+
+
 def _hash(data):
     return sha1(data).hexdigest()
 
 
-def add_tags(key, tags):
-    ctags = app_globals.cache.get_multi(tags)
-    for tag in tags:
-        if not ctags.get(tag):
-            ctags[tag] = key
+def _new_generation():
+    # Start with a time based value instead of 0 so that an evicted
+    # counter cannot fall back to a generation that stale entries were
+    # stored under.
+    return int(now() * 1000)
+
+
+def generation_key(tag):
+    return GENERATION_PREFIX + tag
+
+
+def generation_cache():
+    """
+    The per-process cache of tag generations, so values found in the
+    :func:`local_cache` are returned without asking
+    ``app_globals.cache``. Generations are kept for
+    ``adhocracy.cache.generation_ttl`` seconds (0 disables it), so
+    tags cleared by other processes are seen after at most that long.
+    Tags cleared by this process are seen at once.
+    """
+    global _generations
+    if _generations is None:
+        ttl = int(config.get('adhocracy.cache.generation_ttl', 2))
+        _generations = LRUCache(10000, ttl) if ttl > 0 else False
+    return _generations
+
+
+def get_generations(cache, tags):
+    """
+    Return the current generation of each tag (as returned by
+    ``make_tag``), in the order of ``tags``. Tags that have no counter
+    yet are initialized.
+    """
+    keys = [generation_key(tag) for tag in tags]
+    local = generation_cache()
+    generations = {}
+    if local:
+        for key in keys:
+            generation = local.get(key)
+            if generation is not None:
+                generations[key] = generation
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        fetched = cache.get_multi(missing)
+        for key in missing:
+            generation = fetched.get(key)
+            if generation is None:
+                cache.add(key, _new_generation())
+                generation = cache.get(key) or _new_generation()
+            generations[key] = generation
+            if local:
+                local.set(key, generation)
+    return [generations[key] for key in keys]
+
+
+def _set_local_generation(key, generation):
+    local = generation_cache()
+    if local:
+        if generation is None:
+            local.delete(key)
         else:
-            ctags[tag] = ctags[tag] + SEP + key
-    app_globals.cache.set_multi(ctags)
+            local.set(key, generation)
+
+
+def local_cache():
+    """
+    The per-process cache that is consulted before ``app_globals.cache``.
+    Its entries are stored under keys that include the tag generations,
+    so they become unreachable as soon as a tag is cleared here, and
+    within :func:`generation_cache`'s time to live if it was cleared by
+    another process.
+    Configured with ``adhocracy.cache.local_size`` (0 disables it) and
+    ``adhocracy.cache.local_ttl``.
+    """
+    global _local
+    if _local is None:
+        size = int(config.get('adhocracy.cache.local_size', 1000))
+        ttl = int(config.get('adhocracy.cache.local_ttl', 60))
+        _local = LRUCache(size, ttl) if size > 0 else False
+    return _local
+
+
+def default_grace():
+    """
+    For how many seconds a value memoized with ``grace=True`` may be
+    served after it expired or its tags were cleared while another
+    worker recomputes it. Configured with ``adhocracy.cache.grace``.
+    """
+    return int(config.get('adhocracy.cache.grace', 300))
+
+
+def latest_ttl():
+    """
+    For how many seconds the latest value of a function memoized
+    without ``time`` is kept to be served after an invalidation.
+    Configured with ``adhocracy.cache.latest_ttl``.
+    """
+    return int(config.get('adhocracy.cache.latest_ttl', 3600))
+
+
+def lock_key(key):
+    return LOCK_PREFIX + key
+
+
+def acquire_lock(cache, key):
+    """
+    Try to become the worker that recomputes ``key``. The lock expires
+    after ``adhocracy.cache.lock_timeout`` seconds, so a worker that
+    dies while computing does not block the key forever.
+    """
+    timeout = int(config.get('adhocracy.cache.lock_timeout', 30))
+    return cache.add(lock_key(key), 1, time=timeout)
+
+
+def release_lock(cache, key):
+    cache.delete(lock_key(key))
+
+
+def begin_request():
+    """
+    Start a request scope: until :func:`end_request` is called, repeated
+    calls of a memoized function with equal arguments in this thread are
+    answered from a plain dict, without building a cache key.
+    """
+    _request.cache = {}
+
+
+def end_request():
+    _request.cache = None
+
+
+def request_cache():
+    return getattr(_request, 'cache', None)
+
 
+def memoize_counters():
+    """ A copy of the hit and miss counters per memoize identifier. """
+    return dict((iden, dict(counters))
+                for iden, counters in COUNTERS.items())
 
-def tag_fn(key, args, kwargs):
+
+def _value_size(value):
+    if isinstance(value, basestring):
+        return len(value)
+    try:
+        return len(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return 0
+
+
+def cache_stats():
+    """
+    The counters of :func:`memoize_counters` together with the hit rate,
+    the average compute time in milliseconds and the average size in
+    bytes of the stored values per identifier, and the number of cleared
+    tags.
+    """
+    identifiers = {}
+    for iden, counters in memoize_counters().items():
+        calls = sum(counters.get(k, 0) for k in
+                    ('request_hits', 'local_hits', 'hits', 'stale_hits',
+                     'misses'))
+        misses = counters.get('misses', 0)
+        sets = counters.get('sets', 0)
+        stats = dict(counters)
+        stats['calls'] = calls
+        stats['hit_rate'] = float(calls - misses) / calls if calls else 0.0
+        stats['avg_compute_ms'] = (counters.get('compute_time', 0) * 1000.0
+                                   / misses if misses else 0.0)
+        stats['avg_bytes'] = counters.get('bytes', 0) / sets if sets else 0
+        identifiers[iden] = stats
+    return {'memoize': identifiers,
+            'clear_tag': dict(CLEAR_COUNTERS)}
+
+
+def log_summary(limit=10):
+    """
+    Log the identifiers that spent the most time computing values.
+    """
+    stats = cache_stats()
+    ranked = sorted(stats['memoize'].items(),
+                    key=lambda item: item[1].get('compute_time', 0),
+                    reverse=True)
+    for iden, s in ranked[:limit]:
+        log.info("memoize %s: %d calls, %.0f%% hits, %d misses, "
+                 "%.1fms/compute, %d bytes/value" % (
+                     iden, s['calls'], s['hit_rate'] * 100,
+                     s.get('misses', 0), s['avg_compute_ms'],
+                     s['avg_bytes']))
+    log.info("clear_tag: %(clears)d tags cleared, "
+             "%(batched_clears)d of them in batches" %
+             defaultdict(int, stats['clear_tag']))
+
+
+def _maybe_log_summary():
+    """
+    Call :func:`log_summary` every ``adhocracy.cache.stats_interval``
+    seconds (0 disables it).
+    """
+    global _last_summary
+    interval = int(config.get('adhocracy.cache.stats_interval', 0))
+    if interval and now() - _last_summary > interval:
+        _last_summary = now()
+        log_summary()
+
+
+def tag_fn(args, kwargs):
     tags = [make_tag(a) for a in args]
     tags += [make_tag(v) for v in kwargs.values()]
-    add_tags(key, tags)
+    return tags
 
 
-def make_tag(obj):
-    """ Collisisons here don't matter much. """
-    rep = "catch_all"
+def _tag_rep(obj):
+    """
+    A representation of ``obj`` that is unique for its value. Model
+    objects are represented by their cache key, strings and numbers by
+    their (quoted and escaped) ``repr``, containers by their items.
+    """
+    ref = refs.to_cache_key(obj)
+    if ref is not None:
+        return ref.encode('ascii', 'ignore')
+    if isinstance(obj, tuple):
+        return "(%s)" % ",".join(_tag_rep(o) for o in obj)
+    if isinstance(obj, list):
+        return "[%s]" % ",".join(_tag_rep(o) for o in obj)
+    if isinstance(obj, dict):
+        return "{%s}" % ",".join(sorted("%s:%s" % (_tag_rep(k), _tag_rep(v))
+                                        for (k, v) in obj.items()))
+    if obj is None or isinstance(obj, (basestring, bool, int, long, float)):
+        return repr(obj)
+    # other objects by their text, so memory addresses in the default
+    # repr do not make keys differ between processes
     try:
-        rep = repr(obj).encode('ascii', 'ignore')
+        return "%s:%r" % (type(obj).__name__, unicode(obj))
     except:
         pass
     try:
-        rep = unicode(obj).encode('ascii', 'ignore')
+        return "%s:%r" % (type(obj).__name__, repr(obj))
     except:
-        pass
-    return _hash(rep)
+        return "catch_all"
+
+
+def make_tag(obj):
+    """
+    Model objects are represented by
+    :func:`adhocracy.model.refs.to_cache_key`, which does not hit the
+    database; containers are represented by their items.
+    """
+    return _hash(_tag_rep(obj))
 
 
-def make_key(iden, args, kwargs):
+def make_key(iden, args, kwargs, generations=()):
     sig = iden[:200] + make_tag(args) + make_tag(kwargs)
+    if generations:
+        sig += ":" + ",".join(map(str, generations))
     return sha1(sig).hexdigest()
 
 
 def clear_tag(tag):
+    """
+    Invalidate all cached values that were computed with ``tag`` as an
+    argument by moving the tag to a new generation. The old entries are
+    no longer reachable and expire from the cache eventually. Values
+    remembered in the current request scope are dropped as well.
+
+    Inside :func:`batch_invalidation` the tag is only collected. Returns
+    False if it was already collected in the current batch, so callers
+    can stop cascading to objects that were invalidated before.
+    """
+    tag = make_tag(tag)
+    batch = getattr(_request, 'tags', None)
+    if batch is not None:
+        if tag in batch:
+            return False
+        batch.add(tag)
+        return True
+    CLEAR_COUNTERS['clears'] += 1
+    if request_cache():
+        request_cache().clear()
     try:
-        entities = app_globals.cache.get(make_tag(tag))
-        if entities:
-            app_globals.cache.delete_multi(entities.split(SEP))
+        _bump_generation(app_globals.cache, generation_key(tag))
     except TypeError:
         pass  # when app_globals isn't there yet
+    return True
+
 
+def _bump_generation(cache, key):
+    """
+    Move the generation counter ``key`` to a new generation with an
+    atomic ``incr``, so concurrent clears are never lost.
+    """
+    generation = cache.incr(key)
+    if generation is None:
+        # no counter yet, or it was evicted
+        generation = _new_generation()
+        if not cache.add(key, generation):
+            generation = cache.incr(key)
+    _set_local_generation(key, generation)
 
-def memoize(iden, time=0):
+
+def clear_tags(tags):
+    """
+    Move all ``tags`` (as returned by ``make_tag``) to a new generation,
+    once each.
+    """
+    if not tags:
+        return
+    CLEAR_COUNTERS['clears'] += len(tags)
+    CLEAR_COUNTERS['batched_clears'] += len(tags)
+    if request_cache():
+        request_cache().clear()
+    try:
+        cache = app_globals.cache
+    except TypeError:
+        return  # when app_globals isn't there yet
+    if not cache:
+        return
+    for tag in tags:
+        _bump_generation(cache, generation_key(tag))
+
+
+@contextmanager
+def batch_invalidation():
+    """
+    Collect the tags cleared with :func:`clear_tag` in this thread and
+    clear each of them once when the outermost block is left.
+    """
+    if getattr(_request, 'tags', None) is not None:
+        yield
+        return
+    _request.tags = set()
+    try:
+        yield
+    finally:
+        tags, _request.tags = _request.tags, None
+        clear_tags(tags)
+
+
+def _fetch(cache, fn, a, kw, key, latest, time, grace, counters):
+    """
+    Get the value for ``key`` from ``cache`` or compute and store it.
+    Returns the value and whether it is current. With a ``grace``
+    period only one worker recomputes an expired or invalidated value
+    at a time; the others get the previous value, which is stored
+    under ``latest`` regardless of the tag generations, if there is one.
+    """
+    entry = _entry(cache.get(key))
+    if entry is not None and not entry.is_stale():
+        counters['hits'] += 1
+        return entry.value, True
+    locked = False
+    if grace:
+        locked = acquire_lock(cache, key)
+        if not locked:
+            if entry is None:
+                entry = _entry(cache.get(latest))
+            if entry is not None:
+                counters['stale_hits'] += 1
+                return entry.value, False
+    counters['misses'] += 1
+    try:
+        start = now()
+        res = fn(*a, **kw)
+        counters['compute_time'] += now() - start
+        if res is None:
+            res = NoneResult
+        entry = Entry(res, now() + time if time else None)
+        hard_time = time + grace if time else 0
+        cache.set(key, entry, time=hard_time)
+        counters['sets'] += 1
+        counters['bytes'] += _value_size(res)
+        if grace:
+            cache.set(latest, entry, time=hard_time or latest_ttl())
+    finally:
+        if locked:
+            release_lock(cache, key)
+    return res, True
+
+
+def memoize(iden, time=0, grace=0):
+    """
+    Cache the results of the decorated function in the per-process
+    tier and ``app_globals.cache`` for ``time`` seconds (0 means until
+    one of the arguments is invalidated with :func:`clear_tag`).
+
+    For expensive values, pass ``grace`` (in seconds, or ``True`` for
+    :func:`default_grace`): when such a value expires or is
+    invalidated, it is still served for that long to concurrent
+    callers while a single worker recomputes it, so it is not computed
+    by every worker at once. Without ``grace`` values are never served
+    stale.
+    """
     try:
         from pylons import tmpl_context as c
         iden = c.instance.key + '.' + iden if c.instance else iden
@@ -70,29 +461,51 @@ def memoize(iden, time=0):
     def memoize_fn(fn):
         from adhocracy.lib.cache.util import NoneResult
 
-        def new_fn(*a, **kw):
+        def get_cache():
             try:
-                cache = app_globals.cache
+                return app_globals.cache
             except TypeError:
                 # Probably in tests
-                cache = None
+                return None
+
+        def cached_fn(*a, **kw):
+            cache = get_cache()
             if not cache:
                 res = fn(*a, **kw)
             else:
-                key = make_key(iden, a, kw)
-                res = cache.get(key)
-                if res is None:
-                    res = fn(*a, **kw)
-                    #print "Cache miss", key + iden
-                    if res is None:
-                        res = NoneResult
-                    #print "Cache set:", key + iden
-                    cache.set(key, res, time=time)
-                    tag_fn(key, a, kw)
-                #else:
-                    #print "Cache hit", key + iden
+                counters = COUNTERS[iden]
+                local = local_cache()
+                generations = get_generations(cache, tag_fn(a, kw))
+                key = make_key(iden, a, kw, generations)
+                res = local.get(key) if local else None
+                if res is not None:
+                    counters['local_hits'] += 1
+                else:
+                    grace_time = default_grace() if grace is True else grace
+                    res, current = _fetch(cache, fn, a, kw, key,
+                                          make_key(iden, a, kw),
+                                          time, grace_time, counters)
+                    if local and current:
+                        local.set(key, res, time=time)
                 if res == NoneResult:
                     res = None
+                _maybe_log_summary()
+            return res
+
+        def new_fn(*a, **kw):
+            scope = request_cache()
+            if scope is None or not get_cache():
+                # with caching disabled, every call computes the value
+                return cached_fn(*a, **kw)
+            key = (iden, a, tuple(sorted(kw.items())))
+            try:
+                if key in scope:
+                    COUNTERS[iden]['request_hits'] += 1
+                    return scope[key]
+            except TypeError:
+                # unhashable arguments
+                return cached_fn(*a, **kw)
+            res = scope[key] = cached_fn(*a, **kw)
             return res
         return new_fn
     return memoize_fn
@@ -1,3 +1,4 @@
+from datetime import datetime
 import itertools
 import os
 
@@ -12,10 +13,15 @@ from adhocracy import model
 from adhocracy.lib import search
 
 
-class AdhocracyCommand(Command):
+def standard_parser():
     parser = Command.standard_parser(verbose=True)
     parser.add_option('-c', '--config', dest='config',
             default='development.ini', help='Config file to use.')
+    return parser
+
+
+class AdhocracyCommand(Command):
+    parser = standard_parser()
     default_verbosity = 1
     group_name = 'adhocracy'
 
@@ -87,9 +93,16 @@ class Index(AdhocracyCommand):
     summary = __doc__.split('\n')[0]
     max_args = 999
     min_args = None
+    parser = standard_parser()
+    parser.add_option('-p', '--processes', dest='processes', type='int',
+            default=1, help='Number of processes building documents.')
+    parser.add_option('-s', '--since', dest='since', default=None,
+            help='Reindex only what changed since this UTC time '
+                 '(YYYY-MM-DD[THH:MM:SS]).')
 
     DROP = 'DROP'
     INDEX = 'INDEX'
+    DELTA = 'DELTA'
 
     errors = False
     _indexed_classes = None
@@ -127,7 +140,7 @@ class Index(AdhocracyCommand):
 
     def get_actions(self, args):
         actions = []
-        for action in [self.DROP, self.INDEX]:
+        for action in [self.DROP, self.INDEX, self.DELTA]:
             if action in args:
                 actions.append(action)
                 args.remove(action)
@@ -136,6 +149,25 @@ class Index(AdhocracyCommand):
             self.errors = True
         return args, actions
 
+    def get_since(self, actions):
+        if self.DELTA not in actions:
+            return None
+        since = self.options.since
+        if since is None:
+            since = search.read_watermark()
+            if since is None:
+                print ('No index watermark found. Use --since or run '
+                       'INDEX first.')
+                self.errors = True
+            return since
+        for format_ in (search.WATERMARK_FORMAT, '%Y-%m-%d'):
+            try:
+                return datetime.strptime(since, format_)
+            except ValueError:
+                pass
+        print 'Invalid time "%s"' % since
+        self.errors = True
+
     def command(self):
         self._load_config()
 
@@ -149,11 +181,12 @@ class Index(AdhocracyCommand):
         args, instances = self.get_instances(args)
         args, actions = self.get_actions(args)
         classes = self.get_classes(args)
+        since = self.get_since(actions)
 
         if self.errors:
             exit(1)
         else:
-            self.start(actions, classes, instances)
+            self.start(actions, classes, instances, since)
 
     def printable(self, items, print_=lambda x: x):
         if not items:
@@ -161,7 +194,7 @@ class Index(AdhocracyCommand):
         else:
             return ', '.join([print_(item) for item in items])
 
-    def start(self, actions, classes, instances):
+    def start(self, actions, classes, instances, since=None):
         print ('Starting.\n'
                '  Actions: %s\n'
                '  Content Types: %s\n'
@@ -170,6 +203,9 @@ class Index(AdhocracyCommand):
                    self.printable(classes,
                                   print_=lambda x: x.__name__.lower()),
                    self.printable(instances, print_=lambda x: x.key))
+        # only a run over all content may move the watermark
+        complete = not classes and not instances
+        started = datetime.utcnow()
 
         if self.DROP in actions:
             p_instances = instances if instances else [None]
@@ -181,9 +217,16 @@ class Index(AdhocracyCommand):
                 search.drop(cls, instance)
             print '...done.'
 
-        if self.INDEX in actions:
+        if self.INDEX in actions or self.DELTA in actions:
+            if self.INDEX in actions:
+                since = None
+            else:
+                print 'Reindexing changes since %s' % since
             classes = classes if classes else self.indexed_classes.values()
-            search.rebuild(classes, instances=instances)
+            search.rebuild(classes, instances=instances,
+                           processes=self.options.processes, since=since)
+            if complete:
+                search.write_watermark(started)
             print 'done.'
             return
 
@@ -200,14 +243,18 @@ class Index(AdhocracyCommand):
         indexed_classes = sorted(self.indexed_classes.keys())
         content_types = '\n          '.join(indexed_classes)
         usage += (
-            'index (ALL|DROP) [<entity>, ...] [-I <instance>, ...]'
-            ' -c <inifile>'
+            'index (ALL|DROP|DELTA) [<entity>, ...] [-I <instance>, ...]'
+            ' [-p <processes>] [-s <time>] -c <inifile>'
             '\n\n'
             '  DROP_ALL:\n'
             '      Remove all documents from solr.\n'
             '  ALL\n'
             '      Index all content in solr.\n'
             '      Default if no arguments are given\n'
+            '  DELTA\n'
+            '      Index only content that was created, changed or\n'
+            '      deleted since the time given with -s, or since the\n'
+            '      last complete ALL or DELTA run.\n'
             '  <entity>\n'
             '      Names of a content types to index. If not given,\n'
             '      all content is indexed. Types:\n'
@@ -215,7 +262,55 @@ class Index(AdhocracyCommand):
             '  -I <instance>, ...\n'
             '      Reindex only content from the instances. Note: Users\n'
             '      are dropped if they are member in one of the instances,\n'
-            '      even if they are also member in other instances.'
+            '      even if they are also member in other instances.\n'
+            '  -p <processes>\n'
+            '      Build the documents in this many processes.'
         ) % content_types
 
         return usage
+
+
+class Tallies(AdhocracyCommand):
+    """Create the missing tallies of all polls in instances."""
+    summary = __doc__.split('\n')[0]
+    usage = ('tallies [<instance>, ...] [-b <batch size>] [-r] '
+             '-c <inifile>\n\n'
+             '  <instance>, ...\n'
+             '      Keys of the instances. If not given, all instances\n'
+             '      are processed.\n'
+             '  -b <batch size>\n'
+             '      Number of polls processed per transaction.\n'
+             '  -r\n'
+             '      Also correct the numbers of existing tallies.')
+    max_args = None
+    min_args = None
+    parser = standard_parser()
+    parser.add_option('-b', '--batch-size', dest='batch_size', type='int',
+            default=100, help='Number of polls per transaction.')
+    parser.add_option('-r', '--replace', dest='replace',
+            action='store_true', default=False,
+            help='Also correct the numbers of existing tallies.')
+
+    def command(self):
+        self._load_config()
+        if self.args:
+            instances = []
+            for key in self.args:
+                instance = model.Instance.find(key, include_deleted=True)
+                if not instance:
+                    print 'Instance "%s" not found.' % key
+                    exit(1)
+                instances.append(instance)
+        else:
+            instances = model.Instance.all(include_deleted=True,
+                                           include_hidden=True)
+
+        for instance in instances:
+            changed = 0
+            for count in model.Tally.backfill_instance(
+                    instance, replace=self.options.replace,
+                    batch_size=self.options.batch_size):
+                model.meta.Session.commit()
+                changed += count
+            print '%s: %d tallies created or changed.' % (instance.key,
+                                                         changed)
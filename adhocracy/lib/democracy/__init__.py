@@ -1,6 +1,12 @@
+import json
 import logging
+from time import time
+
+from paste.deploy.converters import asbool
+from pylons import config
 
 from adhocracy.lib.democracy.decision import Decision
+from adhocracy.lib.democracy.delegation_graph import DelegationGraph
 from adhocracy.lib.democracy.delegation_node import DelegationNode
 
 from adhocracy.model import meta
@@ -9,6 +15,12 @@ from adhocracy.model import Delegation, Poll, Proposal, Tally, Vote
 
 log = logging.getLogger(__name__)
 
+PROPAGATE_SERVICE = 'propagate'
+
+# ids of polls that need a recount, see update_delegation()
+DIRTY_POLLS = set()
+_last_flush = 0
+
 
 def init_democracy():
     '''Register callback functions for  :class:`adhocracy.models.Vote`
@@ -26,7 +38,7 @@ def init_democracy():
 def handle_vote(vote):
     #log.debug("Post-processing vote: %s" % vote)
     if Tally.find_by_vote(vote) is None:
-        tally = Tally.create_from_vote(vote)
+        tally = Tally.create_from_vote(vote, incremental=True)
         meta.Session.commit()
         log.debug("Tallied %s: %s" % (vote.poll, tally))
 
@@ -45,7 +57,127 @@ def check_adoptions():
 
 
 def update_delegation(delegation):
-    for poll in Poll.within_scope(delegation.scope):
-        tally = Tally.create_from_poll(poll)
-        meta.Session.commit()
-        log.debug("Tallied %s: %s" % (poll, tally))
+    """
+    Mark the polls affected by a changed delegation for a recount. The
+    tallies are not computed here but in :func:`flush_dirty_polls`, so a
+    burst of delegation changes only recounts each poll once.
+    """
+    polls = Poll.within_scope(delegation.scope)
+    if not polls:
+        return
+    # the principal's own votes override the delegation
+    q = meta.Session.query(Vote.poll_id)
+    q = q.filter(Vote.user_id == delegation.principal_id)
+    q = q.filter(Vote.delegation_id == None)
+    q = q.filter(Vote.poll_id.in_([p.id for p in polls]))
+    self_decided = set(poll_id for (poll_id,) in q.distinct())
+    for poll in polls:
+        if poll.id not in self_decided:
+            DIRTY_POLLS.add(poll.id)
+
+
+def flush_dirty_polls(force=False):
+    """
+    Recount the tallies of all polls marked by :func:`update_delegation`.
+    Unless ``force`` is given this only happens once per
+    ``adhocracy.delegation_tally_interval`` seconds. A poll whose recount
+    fails stays marked and is recounted with the next flush.
+    """
+    global _last_flush
+    interval = int(config.get('adhocracy.delegation_tally_interval', 10))
+    if not DIRTY_POLLS or (not force and time() - _last_flush < interval):
+        return
+    _last_flush = time()
+    for poll_id in sorted(DIRTY_POLLS):
+        try:
+            poll = Poll.find(poll_id, instance_filter=False)
+            if poll is not None:
+                tally = Tally.create_from_poll(poll)
+                meta.Session.commit()
+                log.debug("Tallied %s: %s" % (poll, tally))
+        except Exception, e:
+            log.exception(e)
+            meta.Session.rollback()
+        else:
+            DIRTY_POLLS.discard(poll_id)
+
+
+def is_async_propagation():
+    """
+    Whether delegated votes are cast by the queue worker instead of the
+    web request, see ``adhocracy.async_vote_propagation``.
+    """
+    from adhocracy.lib import queue
+    return (queue.has_queue() and
+            asbool(config.get('adhocracy.async_vote_propagation', 'false')))
+
+
+def post_propagation(vote, event_type):
+    """
+    Ask the queue worker to propagate a vote that was cast with
+    ``Decision.make(..., propagate=False)`` to the principals of its
+    user and to emit an event of ``event_type`` for every vote.
+    Call this after the vote is committed.
+    """
+    from adhocracy.lib import queue
+    from adhocracy.model import refs
+    data = dict(vote=refs.to_ref(vote), event=unicode(event_type))
+    queue.post_message(PROPAGATE_SERVICE, json.dumps(data))
+
+
+def handle_propagation(message):
+    from adhocracy.lib import event
+    from adhocracy.lib.event.types import TYPES
+    from adhocracy.model import refs
+    data = json.loads(message)
+    event_type = dict((unicode(t), t) for t in TYPES).get(data.get('event'))
+    if event_type is None:
+        log.warn("Cannot propagate %s: unknown event type %s." % (
+            data.get('vote'), data.get('event')))
+        return
+    vote = refs.to_entity(data.get('vote'))
+    if not isinstance(vote, Vote):
+        log.warn("Cannot propagate %s: vote not found." % data.get('vote'))
+        return
+    votes = [vote] + propagate_vote(vote)
+    event.emit_many(event_type,
+                    [(v.user, dict(vote=v, poll=vote.poll)) for v in votes],
+                    instance=vote.poll.scope.instance,
+                    topics=[vote.poll.scope])
+    log.debug("Propagated %s to %s principals" % (vote, len(votes) - 1))
+
+
+def propagate_vote(vote):
+    """
+    Cast the votes of all principals that delegated to the user of
+    ``vote``, with a single insert.
+
+    :returns: a list of ``VoteRecord``
+    """
+    poll = vote.poll
+    graph = DelegationGraph(poll.scope.instance)
+    edges = graph.propagate(vote.user, poll.scope,
+                            lambda user, scope, edge: (user, edge),
+                            edge=vote.delegation)
+    # the first edge is the user who cast the vote
+    return Vote.create_many(poll, vote.orientation, edges[1:])
+
+
+def provisional_tally(poll, before, after):
+    """
+    The tally of a poll with one user's decision changed from ``before``
+    to ``after``, as long as the queue has not yet tallied the vote.
+    The returned ``Tally`` is not added to the session.
+    """
+    tally = poll.tally
+    results = {Vote.YES: tally.num_for,
+               Vote.NO: tally.num_against,
+               Vote.ABSTAIN: tally.num_abstain}
+    if before is not None:
+        results[before] -= 1
+    if after is not None:
+        results[after] += 1
+    provisional = Tally(None, results[Vote.YES], results[Vote.NO],
+                        results[Vote.ABSTAIN])
+    provisional.poll_id = poll.id
+    return provisional
@@ -1,12 +1,14 @@
+from itertools import groupby
 import logging
 import math
 
-from sqlalchemy.orm import eagerload
+from sqlalchemy.orm import eagerload, eagerload_all
 
 from adhocracy import model
 from adhocracy.lib.cache import memoize
+from adhocracy.lib.democracy.delegation_graph import DelegationGraph
 from adhocracy.lib.democracy.delegation_node import DelegationNode
-from adhocracy.model import Delegateable, Vote, Poll, User
+from adhocracy.model import Delegateable, Vote, Poll
 
 
 log = logging.getLogger(__name__)
@@ -30,7 +32,7 @@ class Decision(object):
         self.at_time = at_time
         self.node = DelegationNode(user, poll.scope)
         self.votes = votes
-        if not votes:
+        if votes is None:
             self.reload()
 
     def reload(self):
@@ -113,7 +115,7 @@ class Decision(object):
 
     # REFACT: this api is dangeous as it assumes but does not check that
     # REFACT: a poll is actually open for this proposal
-    def make(self, orientation, _edge=None):
+    def make(self, orientation, _edge=None, bulk=False, propagate=True):
         """
         Make a decision on a given proposal, i.e. vote. Voting
         recursively propagates through the delegation graph to all
@@ -123,8 +125,33 @@ class Decision(object):
 
         :param orientation: orientation of the vote, ``Vote.YES``, ``Vote.NO``
             or ``Vote.ABSTAIN``
+        :param bulk: if ``True``, the principals are found in a
+            :class:`DelegationGraph` and all votes are inserted with a
+            single statement. ``VoteRecord`` objects are returned instead
+            of ``Vote`` objects in this case.
+        :param propagate: if ``False``, only the user's own vote is cast.
+            The principals can be reached later with
+            :func:`adhocracy.lib.democracy.propagate_vote`.
         :returns: the ``Votes`` that has been cast
         """
+        if not propagate:
+            vote = Vote(self.user, self.poll, orientation, delegation=_edge)
+            model.meta.Session.add(vote)
+            self.reload()
+            return [vote]
+        if bulk:
+            graph = DelegationGraph(self.poll.scope.instance)
+            edges = graph.propagate(self.user, self.poll.scope,
+                                    lambda user, scope, edge: (user, edge),
+                                    edge=_edge)
+            votes = Vote.create_many(self.poll, orientation, edges)
+            log.debug("Decision was made: %s is voting '%s' on %s "
+                      "(propagated to %s users)" % (repr(self.user),
+                                                    orientation,
+                                                    self.poll,
+                                                    len(votes)))
+            self.reload()
+            return votes
 
         def propagating_vote(user, delegateable, edge):
             vote = Vote(user, self.poll, orientation, delegation=edge)
@@ -186,32 +213,62 @@ class Decision(object):
         """
         Give a list of all decisions the user made within an instance context.
 
+        All votes of the user are loaded with one query and grouped by
+        poll, so no ``Decision`` needs to reload its votes.
+
         :param user: The user for which to list ``Decisions``
         :param instance: an ``Instance`` context.
         """
-        query = model.meta.Session.query(Poll)
-        query = query.distinct().join(Vote)
-        query = query.join(Delegateable)
-        query = query.filter(Delegateable.instance == instance)
-        query = query.filter(Vote.user == user)
-        query = query.options(eagerload(Poll.scope))
-        for poll in query:
-            if not instance or poll.scope.instance == instance:
-                yield cls(user, poll, at_time=at_time)
+        query = model.meta.Session.query(Vote)
+        query = query.join(Vote.poll).join(Poll.scope)
+        query = query.filter(Vote.user_id == user.id)
+        if instance:
+            query = query.filter(Delegateable.instance_id == instance.id)
+        if at_time:
+            query = query.filter(Vote.create_time <= at_time)
+        query = query.options(eagerload(Vote.delegation),
+                              eagerload_all('poll.scope'))
+        query = query.order_by(Vote.poll_id, Vote.id.desc())
+        for poll_id, votes in groupby(query, lambda v: v.poll_id):
+            votes = list(votes)
+            yield cls(user, votes[0].poll, at_time=at_time, votes=votes)
 
     @classmethod
-    def for_poll(cls, poll, at_time=None):
+    def for_poll(cls, poll, at_time=None, user_ids=None):
         """
-        Get all decisions that have been made on a poll.
+        Get all decisions that have been made on a poll. The votes of
+        all users are loaded at once, so this does not issue a query
+        per voter.
 
         :param poll: The poll on which to get decisions.
+        :param user_ids: If given, only the decisions of these users.
+        """
+        return [Decision(user, poll, at_time=at_time, votes=votes)
+                for (user, votes) in cls._votes_by_user(poll, at_time,
+                                                        user_ids)]
+
+    @classmethod
+    def _votes_by_user(cls, poll, at_time=None, user_ids=None):
+        """
+        Load all votes that have been cast on a poll with a single query
+        and group them by user. The votes of each user are ordered like
+        in :meth:`reload`, so they can be passed to ``Decision`` as
+        ``votes``.
+
+        :returns: generator of ``(User, [Vote])`` tuples
         """
-        query = model.meta.Session.query(User)
-        query = query.distinct().join(Vote)
+        query = model.meta.Session.query(Vote)
         query = query.filter(Vote.poll_id == poll.id)
+        query = query.options(eagerload(Vote.delegation),
+                              eagerload(Vote.user))
         if at_time:
             query = query.filter(Vote.create_time <= at_time)
-        return [Decision(u, poll, at_time=at_time) for u in query]
+        if user_ids is not None:
+            query = query.filter(Vote.user_id.in_(list(user_ids)))
+        query = query.order_by(Vote.user_id, Vote.id.desc())
+        for user_id, votes in groupby(query, lambda v: v.user_id):
+            votes = list(votes)
+            yield (votes[0].user, votes)
 
     @classmethod
     def average_decisions(cls, instance):
@@ -222,7 +279,7 @@ class Decision(object):
 
         :param instance: the ``Instance`` for which to calculate the average.
         """
-        @memoize('average_decisions', 84600)
+        @memoize('average_decisions', 84600, grace=True)
         def avg_decisions(instance):
             query = model.meta.Session.query(Poll)
             query = query.join(Delegateable)
@@ -0,0 +1,244 @@
+from datetime import datetime
+import logging
+
+from sqlalchemy import or_
+from sqlalchemy.orm import eagerload
+
+from adhocracy import model
+from adhocracy.model import Delegateable, Delegation, ScopeIndex, Vote
+
+log = logging.getLogger(__name__)
+
+
+class DelegationGraph(object):
+    """
+    A ``DelegationGraph`` holds all delegations of an ``Instance`` that
+    are active at a given point in time in memory. It is loaded with one
+    query for the delegations and one for the scope hierarchy and then
+    answers the same questions as
+    :class:`adhocracy.lib.democracy.delegation_node.DelegationNode`
+    without going back to the database for every node.
+
+    The graph is a snapshot. Delegations created or revoked after it was
+    loaded are not visible, so it should be used for one request or one
+    batch of work and then be thrown away. :meth:`for_instance` keeps
+    one graph per instance on the current session until a flush touches
+    a delegation, vote or delegateable.
+
+    :param instance: The ``Instance`` whose delegations are loaded.
+    :param at_time: Load the delegation graph at the given time, defaults
+        to the current time.
+    """
+
+    def __init__(self, instance, at_time=None):
+        if at_time is None:
+            at_time = datetime.utcnow()
+        self.instance = instance
+        self.at_time = at_time
+        # (agent_id, scope_id) -> [Delegation]
+        self._inbound = {}
+        # (principal_id, scope_id) -> [Delegation]
+        self._outbound = {}
+        self._self_decided = {}
+        self._load()
+
+    @classmethod
+    def for_instance(cls, instance):
+        session = model.meta.Session()
+        if session.autoflush:
+            # like a query would, so pending changes drop the graph
+            session.flush()
+        graph = getattr(session, '_delegation_graphs', {}).get(instance.id)
+        if graph is None:
+            # loading may autoflush and invalidate, so store it afterwards
+            graph = cls(instance)
+            if not hasattr(session, '_delegation_graphs'):
+                session._delegation_graphs = {}
+            session._delegation_graphs[instance.id] = graph
+        return graph
+
+    def _load(self):
+        query = model.meta.Session.query(Delegation)
+        query = query.join(Delegateable)
+        query = query.filter(Delegateable.instance_id == self.instance.id)
+        query = query.filter(Delegation.create_time <= self.at_time)
+        query = query.filter(or_(Delegation.revoke_time == None,
+                                 Delegation.revoke_time > self.at_time))
+        query = query.options(eagerload(Delegation.principal),
+                              eagerload(Delegation.agent))
+        for delegation in query:
+            self._inbound.setdefault(
+                (delegation.agent_id, delegation.scope_id),
+                []).append(delegation)
+            self._outbound.setdefault(
+                (delegation.principal_id, delegation.scope_id),
+                []).append(delegation)
+        self.scopes = ScopeIndex.for_instance(self.instance.id)
+
+    def _scope_ids(self, scope_id, recurse, _seen=None):
+        """
+        The scope and, if ``recurse`` is set, all of its parents in the
+        order in which ``DelegationNode`` traverses them.
+        """
+        if _seen is None:
+            _seen = set()
+        if scope_id in _seen:
+            return []
+        _seen.add(scope_id)
+        scope_ids = [scope_id]
+        if recurse:
+            for parent_id in self.scopes.parents.get(scope_id, []):
+                scope_ids += self._scope_ids(parent_id, recurse, _seen)
+        return scope_ids
+
+    def _traverse(self, edges, user_id, scope_id, recurse):
+        delegations = []
+        for sid in self._scope_ids(scope_id, recurse):
+            delegations += edges.get((user_id, sid), [])
+        return delegations
+
+    def filter_less_specific_delegations(self, delegations):
+        """
+        Same as
+        :meth:`DelegationNode.filter_less_specific_delegations`, but
+        resolves the scope hierarchy from memory.
+        """
+        matches = list(delegations)
+        for d in delegations:
+            for m in matches:
+                if self.scopes.is_super(m.scope_id, d.scope_id):
+                    matches.remove(m)
+        return matches
+
+    def inbound(self, user, delegateable, recurse=True,
+                is_counting_delegations=False):
+        """
+        Retrieve all inbound delegations (i.e. those that the user has received
+        from other users in order to vote on their behalf) that apply to the
+        ``Delegateable``.
+
+        :param recurse: if ``True``, search will include delegations on parent
+            ``Delegateables`` in breadth-first traversal order.
+        :returns: list of ``Delegation``
+        """
+        delegations = self._traverse(self._inbound, user.id,
+                                     delegateable.id, recurse)
+        delegations = self._filter_out_overriden_delegations(delegations)
+        if is_counting_delegations:
+            delegations = [
+                d for d in delegations
+                if self._is_most_specific_for(d, user, delegateable)]
+        return filter(self._is_overriden_by_own_decision, delegations)
+
+    def transitive_inbound(self, user, delegateable, recurse=True,
+                           is_counting_delegations=False, _path=None):
+        """
+        Retrieve inbound delegations recursing through the delegation graph
+        as well as through the category tree.
+
+        :returns: list of ``Delegation``
+        """
+        if _path is None:
+            _path = []
+        elif user in _path:
+            return []
+        _path.append(user)
+
+        delegations = self.inbound(
+            user, delegateable, recurse=recurse,
+            is_counting_delegations=is_counting_delegations)
+        for delegation in list(delegations):
+            additional_delegations = self.transitive_inbound(
+                delegation.principal, delegateable, recurse=recurse,
+                is_counting_delegations=is_counting_delegations,
+                _path=_path)
+            for additional_delegation in additional_delegations:
+                if additional_delegation.principal not in _path:
+                    delegations.append(additional_delegation)
+        _path.remove(user)
+        return delegations
+
+    def outbound(self, user, delegateable, recurse=True, filter=True):
+        """
+        Retrieve all outbound delegations (i.e. those that the user has given
+        to other users in order allow them to vote on his/her behalf) that
+        apply to the ``Delegateable``.
+
+        :returns: list of ``Delegation``
+        """
+        delegations = self._traverse(self._outbound, user.id,
+                                     delegateable.id, recurse)
+        if filter:
+            by_agent = dict()
+            for delegation in set(delegations):
+                by_agent.setdefault(delegation.agent, []).append(delegation)
+            delegations = [self.filter_less_specific_delegations(ds)[0] for
+                           ds in by_agent.values()]
+        return delegations
+
+    def propagate(self, user, delegateable, callable, edge=None,
+                  _propagation_path=None):
+        """
+        Propagate a given action along the delegation graph *against*
+        its direction, see :meth:`DelegationNode.propagate`.
+
+        :param edge: The delegation through which ``user`` is reached,
+            passed to the callable for ``user`` itself.
+        :returns: a list of all results produced by the callable.
+        """
+        if _propagation_path is None:
+            _propagation_path = set()
+        if user.id in _propagation_path:
+            return []
+        _propagation_path.add(user.id)
+
+        result = [callable(user, delegateable, edge)]
+        if not self.instance.allow_delegate:
+            return result
+        for delegation in self.inbound(user, delegateable):
+            result += self.propagate(delegation.principal, delegateable,
+                                     callable, edge=delegation,
+                                     _propagation_path=_propagation_path)
+        return result
+
+    def number_of_delegations(self, user, delegateable):
+        return len(self.transitive_inbound(user, delegateable,
+                                           is_counting_delegations=True))
+
+    def _filter_out_overriden_delegations(self, delegations):
+        by_principal = dict()
+        for delegation in set(delegations):
+            by_principal.setdefault(delegation.principal,
+                                    []).append(delegation)
+        return [self.filter_less_specific_delegations(ds)[0] for
+                ds in by_principal.values()]
+
+    def _is_most_specific_for(self, delegation, user, delegateable):
+        outbound_delegations = self.outbound(delegation.principal,
+                                             delegateable)
+        if 1 == len(outbound_delegations):
+            return outbound_delegations[0].agent == user
+        elif len(outbound_delegations) > 1:
+            smallest_delegations = [outbound_delegations[0]]
+            for other in outbound_delegations:
+                scope_id = smallest_delegations[0].scope_id
+                if self.scopes.is_super(scope_id, other.scope_id):
+                    smallest_delegations = [other]
+                elif scope_id == other.scope_id:
+                    smallest_delegations.append(other)
+            for other in smallest_delegations:
+                if other.agent == user:
+                    return True
+        return False
+
+    def _is_overriden_by_own_decision(self, delegation):
+        poll = getattr(delegation.scope, 'poll', None)
+        if poll is None:
+            return True  # no poll in this scope -> can't self decide
+        if poll.id not in self._self_decided:
+            query = model.meta.Session.query(Vote.user_id)
+            query = query.filter(Vote.poll_id == poll.id)
+            query = query.filter(Vote.delegation_id == None)
+            self._self_decided[poll.id] = set(
+                user_id for (user_id,) in query.distinct())
+        return delegation.principal_id not in self._self_decided[poll.id]
@@ -4,6 +4,7 @@ import logging
 from sqlalchemy import or_
 
 from adhocracy import model
+from adhocracy.lib.democracy.delegation_graph import DelegationGraph
 from adhocracy.model import Delegation
 
 log = logging.getLogger(__name__)
@@ -201,7 +202,8 @@ class DelegationNode(object):
         return result
 
     def number_of_delegations(self):
-        return len(self.transitive_inbound(is_counting_delegations=True))
+        graph = DelegationGraph.for_instance(self.delegateable.instance)
+        return graph.number_of_delegations(self.user, self.delegateable)
 
     def __repr__(self):
         return "<DelegationNode(%s,%s)>" % (self.user.user_name,
@@ -1,4 +1,6 @@
+from contextlib import contextmanager
 import logging
+import threading
 
 from adhocracy import model
 from adhocracy.lib import queue
@@ -29,9 +31,73 @@ log = logging.getLogger(__name__)
 SERVICE = 'event'
 
 
+class EventBatch(object):
+    """
+    Collects the events emitted within :func:`batch`. The events are
+    inserted with one flush, the session is committed once and a single
+    queue message carrying all event ids is posted.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def add(self, event):
+        model.meta.Session.add(event)
+        self.events.append(event)
+
+    def publish(self):
+        if not len(self.events):
+            return
+        model.meta.Session.flush()
+        model.meta.Session.commit()
+        ids = [event.id for event in self.events]
+        if queue.has_queue():
+            queue.post_message(SERVICE, ','.join(map(str, ids)))
+        else:
+            log.warn("Queue failure.")
+            process_many(self.events)
+        log.debug("Events: %s" % ids)
+
+
+_batches = threading.local()
+
+
+def _current_batch():
+    return getattr(_batches, 'batch', None)
+
+
+@contextmanager
+def batch():
+    """
+    Emission context: all events emitted with :func:`emit` inside the
+    ``with`` block are published together when the block is left. The
+    session is committed at that point. Nested contexts join the
+    outermost one.
+
+        with event.batch():
+            for vote in votes:
+                event.emit(T_VOTE_CAST, vote.user, vote=vote, ...)
+    """
+    if _current_batch() is not None:
+        yield _current_batch()
+        return
+    current = EventBatch()
+    _batches.batch = current
+    try:
+        yield current
+    finally:
+        _batches.batch = None
+    current.publish()
+
+
 def emit(event, user, instance=None, topics=[], **kwargs):
     event = model.Event(event, user, kwargs, instance=instance)
     event.topics = topics
+    current = _current_batch()
+    if current is not None:
+        current.add(event)
+        return event
+
     model.meta.Session.add(event)
     model.meta.Session.commit()
 
@@ -45,14 +111,39 @@ def emit(event, user, instance=None, topics=[], **kwargs):
     return event
 
 
-def process(event):
-    notification.notify(event)
+def emit_many(event, emissions, instance=None, topics=[]):
+    """
+    Emit one event of the type ``event`` for every ``(user, kwargs)``
+    pair in ``emissions`` within a single :func:`batch`.
 
+    :returns: the list of created ``Event`` objects
+    """
+    with batch():
+        return [emit(event, user, instance=instance, topics=topics, **kwargs)
+                for (user, kwargs) in emissions]
 
-def handle_queue_message(message):
-    event = model.Event.find(int(message), instance_filter=False)
-    process(event)
 
+def process(event, cache=None):
+    notification.notify(event, cache=cache)
+
+
+def process_many(events):
+    """
+    Process a batch of events. Watchlist lookups for the topics the
+    events share are only made once.
+    """
+    cache = {}
+    for event in events:
+        process(event, cache=cache)
+
+
+def handle_queue_message(message):
+    ids = [int(id) for id in message.split(',')]
+    events = model.Event.find_all(ids, instance_filter=False)
+    if len(events) < len(ids):
+        log.warn("Events not found: %s" % (
+            set(ids) - set(e.id for e in events)))
+    process_many(events)
 
 
 # The funny thing about this line is: YOU DO NOT SEE IT!
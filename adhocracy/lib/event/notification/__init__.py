@@ -17,19 +17,24 @@ def echo(f):
         yield x
 
 
-def notify(event):
+def notify(event, cache=None):
     '''
     been too smart today ;)
+
+    :param cache: a dict shared between the events of one batch to
+        look up the watchlists of common topics only once.
     '''
     if not event:
         log.warn("Received null as event, shouldn't happen!")
         return
     log.debug("Event notification processing: %s" % event)
     begin_time = time()
-    sources = filter(lambda g: g, [watchlist_source(event),
+    if cache is None:
+        cache = {}
+    sources = filter(lambda g: g, [watchlist_source(event, cache),
                                    vote_source(event),
                                    instance_source(event),
-                                   tag_source(event),
+                                   tag_source(event, cache),
                                    delegation_source(event),
                                    comment_source(event)])
     pipeline = chain(*sources)
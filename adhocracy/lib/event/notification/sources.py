@@ -12,10 +12,19 @@ from adhocracy.lib.event.types import (
     T_RATING_CAST, T_SELECT_VARIANT, T_VOTE_CAST)
 
 
-def watchlist_source(event):
+def _traverse_watchlist(entity, cache):
+    if cache is None:
+        return watchlist.traverse_watchlist(entity)
+    key = (entity.__class__, entity.id)
+    if key not in cache:
+        cache[key] = watchlist.traverse_watchlist(entity)
+    return list(cache[key])
+
+
+def watchlist_source(event, cache=None):
     watches = watchlist.traverse_watchlist(event.user)
     for topic in event.topics:
-        watches += watchlist.traverse_watchlist(topic)
+        watches += _traverse_watchlist(topic, cache)
     for watch in watches:
         yield Notification(event, watch.user, watch=watch)
 
@@ -62,11 +71,11 @@ def instance_source(event):
                            type=N_INSTANCE_MEMBERSHIP_UPDATE)
 
 
-def tag_source(event):
+def tag_source(event, cache=None):
     watches = []
     for topic in event.topics:
         for (tag, count) in topic.tags:
-            watches = watchlist.traverse_watchlist(tag)
+            watches = _traverse_watchlist(tag, cache)
     for watch in set(watches):
         yield Notification(event, watch.user, watch=watch)
 
@@ -9,27 +9,61 @@ from adhocracy.lib.util import timedelta2seconds
 log = logging.getLogger(__name__)
 
 
-def activity(query_filter, from_time=None, to_time=None):
+def _window(from_time, to_time):
     if not to_time:
         to_time = datetime.utcnow()
     if not from_time:
         from_time = to_time - timedelta(days=30)
+    return from_time, to_time
+
+
+def _event_value(from_time, to_time):
     base_age = timedelta2seconds(to_time - from_time)
 
+    def evt_value(event_time):
+        age = base_age - timedelta2seconds(to_time - event_time)
+        return math.log(max(1, age))
+    return evt_value
+
+
+def activity(query_filter, from_time=None, to_time=None):
+    from_time, to_time = _window(from_time, to_time)
+    evt_value = _event_value(from_time, to_time)
+
     query = model.meta.Session.query(model.Event.time)
     query = query.filter(model.Event.time >= from_time)
     query = query.filter(model.Event.time <= to_time)
     query = query.order_by(model.Event.time.asc())
     query = query_filter(query)
 
-    def evt_value(event_time):
-        age = base_age - timedelta2seconds(to_time - event_time)
-        return math.log(max(1, age))
-
     act = sum([evt_value(row[0]) for row in query])
     return act
 
 
+def user_activities(user_ids, from_time=None, to_time=None):
+    '''
+    Compute the activity of each of the users with *user_ids* in each
+    instance with one query. Returns a dict mapping (user id, instance
+    id) to the activity; see :func:`user_activity`.
+    '''
+    from_time, to_time = _window(from_time, to_time)
+    evt_value = _event_value(from_time, to_time)
+    event_table = model.event_table
+
+    query = model.meta.Session.query(event_table.c.user_id,
+                                     event_table.c.instance_id,
+                                     event_table.c.time)
+    query = query.filter(event_table.c.user_id.in_(user_ids))
+    query = query.filter(event_table.c.time >= from_time)
+    query = query.filter(event_table.c.time <= to_time)
+
+    activities = {}
+    for (user_id, instance_id, event_time) in query:
+        key = (user_id, instance_id)
+        activities[key] = activities.get(key, 0) + evt_value(event_time)
+    return activities
+
+
 @memoize('instance_activity', 84600)
 def instance_activity(instance, from_time=None, to_time=None):
     def query_filter(q):
@@ -13,7 +13,7 @@ from webob.multidict import MultiDict
 
 from adhocracy import model
 from adhocracy.lib import sorting, tiles
-from adhocracy.lib.event.stats import user_activity
+from adhocracy.lib.search import facts
 from adhocracy.lib.search.query import sunburnt_query, add_wildcard_query
 from adhocracy.lib.templating import render_def
 from adhocracy.model.refs import ref_attr_value
@@ -839,7 +839,7 @@ class ProposalNumCommentsIndexer(SolrIndexer):
     @classmethod
     def add_data_to_index(cls, entity, data):
         if isinstance(entity, model.Delegateable):
-            data[cls.solr_field] = len(entity.comments)
+            data[cls.solr_field] = facts.comment_count(entity)
 
 
 class ProposalNewestCommentsIndexer(SolrIndexer):
@@ -849,8 +849,8 @@ class ProposalNewestCommentsIndexer(SolrIndexer):
     @classmethod
     def add_data_to_index(cls, entity, data):
         if isinstance(entity, model.Proposal):
-            if entity.comment_count() > 0:
-                commenttime = entity.find_latest_comment_time()
+            commenttime = facts.newest_comment_time(entity)
+            if commenttime is not None:
                 value = time.mktime(commenttime.timetuple())
                 data[cls.solr_field] = value
 
@@ -922,7 +922,7 @@ class InstanceUserActivityIndexer(SolrIndexer):
         if isinstance(entity, model.User):
             activity_sum = 0
             for instance in entity.instances:
-                activity = user_activity(instance, entity)
+                activity = facts.user_activity(instance, entity)
                 data[cls.solr_field(instance)] = activity
                 activity_sum = activity_sum + activity
             data[cls.solr_field()] = activity_sum
@@ -38,18 +38,34 @@ def dispatch():
     from adhocracy.lib import event
     from adhocracy.lib import broadcast
 
+    from adhocracy.lib.search import index
+    index.start_buffering()
+
     def _handle_message(message):
+        try:
+            _dispatch_message(message)
+        finally:
+            from adhocracy.lib import democracy
+            democracy.flush_dirty_polls()
+            index.flush_buffer()
+            model.meta.Session.remove()
+
+    def _dispatch_message(message):
+        from adhocracy.lib import democracy
         service = message.application_headers.get('service')
         if service == UPDATE_SERVICE:
             handle_update(message.body)
         elif service == event.SERVICE:
             event.handle_queue_message(message.body)
+        elif service == democracy.PROPAGATE_SERVICE:
+            democracy.handle_propagation(message.body)
         elif service == broadcast.REPORT_SERVICE:
             broadcast.handle_abuse_message(message.body)
         elif service == MINUTE:
             log.debug("Minutely housekeeping...")
-            from adhocracy.lib import democracy
+            democracy.flush_dirty_polls(force=True)
             democracy.check_adoptions()
+            index.flush_buffer(force=True)
         elif service == HOURLY:
             log.debug("Hourly housekeeping...")
             pass
@@ -58,5 +74,7 @@ def dispatch():
             # housekeeping
             from adhocracy.lib import watchlist
             watchlist.clean_stale_watches()
-        model.meta.Session.remove()
-    consume(_handle_message)
+    try:
+        consume(_handle_message)
+    finally:
+        index.flush_buffer(force=True)
@@ -1,10 +1,18 @@
 '''Integrate solr with adhocracy'''
 
+from datetime import datetime
+from itertools import imap
 import logging
+from multiprocessing import Pool
+import os
 import time
 
+from pylons import config
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import class_mapper, eagerload
+
 from adhocracy import model
-from adhocracy.lib.search import index, query
+from adhocracy.lib.search import facts, index, query
 
 
 log = logging.getLogger(__name__)
@@ -13,6 +21,19 @@ log = logging.getLogger(__name__)
 INDEXED_CLASSES = (model.Proposal, model.Instance, model.User,
                    model.Comment, model.Page, model.Milestone)
 
+# Relations that the indexers use, loaded together with a batch of
+# entities during a rebuild.
+INDEX_EAGER_LOADS = {
+    model.Proposal: ['creator', 'instance', 'parents', 'milestone',
+                     'description'],
+    model.Page: ['creator', 'instance', 'parents', 'milestone'],
+    model.Instance: ['creator'],
+    model.User: ['memberships', 'memberships.instance'],
+    model.Comment: ['topic', 'topic.instance'],
+    model.Milestone: []}
+
+WATERMARK_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
 
 def init_search():
     '''Register callback functions for commit hooks to add/update and
@@ -26,49 +47,193 @@ def init_search():
         LISTENERS[(cls, DELETE)].append(index.delete)
 
 
-def rebuild(classes, instances=None):
+def _filter_instances(q, cls, instance_ids):
+    if cls is model.Instance:
+        return q.filter(cls.id.in_(instance_ids))
+    elif hasattr(cls, 'instance_id'):
+        return q.filter(cls.instance_id.in_(instance_ids))
+    elif hasattr(cls, 'topic_id'):
+        return q.filter(cls.topic_id.in_(instance_ids))
+    elif cls is model.User:
+        return q.filter(model.User.memberships.any(
+            model.Membership.instance_id.in_(instance_ids)))
+    return q
+
+
+def _changed_since(cls, since):
+    '''
+    A condition matching the entities of *cls* that were created,
+    modified or deleted at or after *since*, judged by their own time
+    stamps and by the texts, revisions and events that refer to them.
+    '''
+    conditions = [cls.create_time >= since]
+    for name in ('delete_time', 'modify_time'):
+        if hasattr(cls, name):
+            conditions.append(getattr(cls, name) >= since)
+    event_table = model.event_table
+    if issubclass(cls, model.Delegateable):
+        # access_time is updated with every change of the row
+        conditions.append(cls.access_time >= since)
+        topic_table = model.event_topic_table
+        conditions.append(cls.id.in_(select(
+            [topic_table.c.topic_id],
+            and_(topic_table.c.event_id == event_table.c.id,
+                 event_table.c.time >= since))))
+        text_table = model.text_table
+        changed_pages = select(
+            [text_table.c.page_id],
+            or_(text_table.c.create_time >= since,
+                text_table.c.delete_time >= since))
+        if cls is model.Proposal:
+            conditions.append(cls.description_id.in_(changed_pages))
+        else:
+            conditions.append(cls.id.in_(changed_pages))
+    elif cls is model.Comment:
+        revision_table = model.revision_table
+        conditions.append(cls.id.in_(select(
+            [revision_table.c.comment_id],
+            revision_table.c.create_time >= since)))
+    elif cls is model.User:
+        conditions.append(cls.id.in_(select(
+            [event_table.c.user_id], event_table.c.time >= since)))
+    elif cls is model.Instance:
+        conditions.append(cls.id.in_(select(
+            [event_table.c.instance_id], event_table.c.time >= since)))
+    return or_(*conditions)
+
+
+def _id_batches(cls, instance_ids, batch_size, since=None):
+    q = model.meta.Session.query(cls.id).order_by(cls.id)
+    if instance_ids:
+        q = _filter_instances(q, cls, instance_ids)
+    if since is not None:
+        q = q.filter(_changed_since(cls, since))
+    batch = []
+    for (id_,) in q.yield_per(batch_size):
+        batch.append(id_)
+        if len(batch) == batch_size:
+            yield (cls.__name__, batch)
+            batch = []
+    if batch:
+        yield (cls.__name__, batch)
+
+
+def build_docs(batch):
+    '''
+    Load the entities of a *batch* (a class name and a list of ids)
+    together with the relations in :data:`INDEX_EAGER_LOADS` and return
+    the update information for each of them. The data the indexers need
+    is gathered for the whole batch with :mod:`facts`.
+
+    Entities that were not in the session before are expunged again
+    afterwards, so a rebuild does not keep all of them in memory.
+    '''
+    cls_name, ids = batch
+    cls = dict((c.__name__, c) for c in INDEXED_CLASSES)[cls_name]
+    session = model.meta.Session()
+    mapper = class_mapper(cls)
+    present = set(id_ for id_ in ids if
+                  mapper.identity_key_from_primary_key([id_]) in
+                  session.identity_map)
+    q = model.meta.Session.query(cls).filter(cls.id.in_(ids))
+    for relation in INDEX_EAGER_LOADS.get(cls, []):
+        q = q.options(eagerload(relation))
+    entities = q.all()
+    with facts.gathered(entities):
+        docs = [index.get_update_information(entity) for entity in entities]
+    for entity in entities:
+        if entity.id not in present:
+            session.expunge(entity)
+    return docs
+
+
+def _build_docs_in_worker(batch):
+    '''
+    :func:`build_docs` for the worker processes of :func:`rebuild`,
+    which drop everything they loaded after each batch.
+    '''
+    try:
+        return build_docs(batch)
+    finally:
+        model.meta.Session.expunge_all()
+
+
+def watermark_path():
+    return config.get('adhocracy.solr.watermark_file',
+                      os.path.join(config['cache_dir'], 'index_watermark'))
+
+
+def read_watermark():
+    '''
+    The time of the last complete (delta) reindex stored with
+    :func:`write_watermark`, or None.
+    '''
+    try:
+        with open(watermark_path()) as f:
+            return datetime.strptime(f.read().strip(), WATERMARK_FORMAT)
+    except (IOError, ValueError):
+        return None
+
+
+def write_watermark(timestamp):
+    with open(watermark_path(), 'w') as f:
+        f.write(timestamp.strftime(WATERMARK_FORMAT))
+
+
+def rebuild(classes, instances=None, processes=1, batch_size=1000,
+            since=None):
     '''
-    (Re)Index all entities of the given *classes*.
+    (Re)Index all entities of the given *classes*. If *since* (a
+    datetime) is given, only the entities that changed since then are
+    reindexed.
+
+    The ids are read in batches of *batch_size*. With more than one
+    *processes*, the documents of the batches are built in a pool of
+    worker processes while the parent posts finished batches to solr.
     '''
     log = logging.getLogger('index')
     connection = index.get_sunburnt_connection()
     start = time.time()
-    batch_start = time.time()
-    done = 0
-    other_classes = 0
-    docs = {index.ADD: [],
-            index.SKIP: [],
-            index.DELETE: [],
-            index.IGNORE: []}
     instance_ids = [i.id for i in instances] if instances else None
+    pool = None
+    if processes > 1:
+        # close all database connections so that the worker processes
+        # don't inherit them
+        model.meta.Session.remove()
+        model.meta.engine.dispose()
+        pool = Pool(processes)
+    done = 0
 
-    for cls in classes:
-        if cls not in INDEXED_CLASSES:
-            log.warn('Class "%s" is not an indexable class! skipping.' %
-                     cls)
-            continue
-        log.info("Re-indexing %ss..." % cls.__name__)
-        q = model.meta.Session.query(cls)
-        if instances:
-            if isinstance(cls, model.Instance):
-                q = q.filter(cls.id.in_(instance_ids))
-            elif hasattr(cls, 'instance_id'):
-                q = q.filter(cls.instance_id.in_(instance_ids))
-            elif hasattr(cls, 'topic_id'):
-                q = q.filter(cls.topic_id.in_(instance_ids))
-            elif cls is model.User:
-                q = q.filter(model.User.memberships.any(
-                    model.Membership.instance_id.in_(instance_ids)))
-        for entity in q:
-            (action, data) = index.get_update_information(entity)
-            docs[action].append(data)
-            done = done + 1
-            if done % 1000 == 0:
-                docs = commit_docs(docs, connection, log, start, batch_start)
+    try:
+        for cls in classes:
+            if cls not in INDEXED_CLASSES:
+                log.warn('Class "%s" is not an indexable class! skipping.' %
+                         cls)
+                continue
+            log.info("Re-indexing %ss..." % cls.__name__)
+            batches = _id_batches(cls, instance_ids, batch_size, since)
+            if pool is not None:
+                results = pool.imap(_build_docs_in_worker, batches)
+            else:
+                results = imap(build_docs, batches)
+            class_done = 0
+            batch_start = time.time()
+            for result in results:
+                docs = {index.ADD: [],
+                        index.SKIP: [],
+                        index.DELETE: [],
+                        index.IGNORE: []}
+                for (action, data) in result:
+                    docs[action].append(data)
+                commit_docs(docs, connection, log, start, batch_start)
                 batch_start = time.time()
-        log.info("...re-indexed %s %ss" % (done - other_classes, cls.__name__))
-        other_classes = done
-    commit_docs(docs, connection, log, start, batch_start)
+                class_done += len(result)
+            log.info("...re-indexed %s %ss" % (class_done, cls.__name__))
+            done += class_done
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
     now = time.time()
     log.info('total: %s updates, %0.1f s' % (done, now - start))
 
@@ -0,0 +1,146 @@
+'''
+Facts about a batch of entities that the indexers in
+:mod:`adhocracy.lib.pager` need, gathered with one grouped query per
+fact instead of several queries per entity.
+
+Use :func:`gathered` around building the documents of a batch; the
+indexers read the facts through the functions of this module, which
+fall back to asking the entity if no facts were gathered for it.
+'''
+from contextlib import contextmanager
+from datetime import datetime
+import threading
+
+from sqlalchemy import and_, func, or_
+
+from adhocracy import model
+from adhocracy.lib.event import stats
+
+_local = threading.local()
+
+
+class IndexFacts(object):
+
+    def __init__(self, entities):
+        delegateables = [e for e in entities
+                         if isinstance(e, model.Delegateable)]
+        proposals = [e for e in delegateables
+                     if isinstance(e, model.Proposal)]
+        comments = [e for e in entities if isinstance(e, model.Comment)]
+        users = [e for e in entities if isinstance(e, model.User)]
+
+        self.delegateable_ids = set(d.id for d in delegateables)
+        self.proposal_ids = set(p.id for p in proposals)
+        self.user_ids = set(u.id for u in users)
+
+        self.comment_counts = self._comment_counts(self.delegateable_ids)
+        descriptions = [p.description_id for p in proposals
+                        if p.description_id is not None]
+        self.live_comment_counts = self._comment_counts(descriptions,
+                                                        live=True)
+        self.newest_comment_times = self._newest_comment_times(descriptions)
+        self.user_activities = {}
+        if users:
+            self.user_activities = stats.user_activities(
+                list(self.user_ids))
+
+        polls = [p.rate_poll for p in proposals if p.rate_poll is not None]
+        polls += [c.poll for c in comments if c.poll is not None]
+        self._prime_tallies(polls)
+
+    def _comment_counts(self, topic_ids, live=False):
+        if not topic_ids:
+            return {}
+        comment_table = model.comment_table
+        q = model.meta.Session.query(comment_table.c.topic_id,
+                                     func.count(comment_table.c.id))
+        q = q.filter(comment_table.c.topic_id.in_(list(topic_ids)))
+        if live:
+            q = q.filter(or_(comment_table.c.delete_time == None,
+                             comment_table.c.delete_time > datetime.utcnow()))
+        q = q.group_by(comment_table.c.topic_id)
+        return dict(q)
+
+    def _newest_comment_times(self, topic_ids):
+        if not topic_ids:
+            return {}
+        comment_table = model.comment_table
+        revision_table = model.revision_table
+        q = model.meta.Session.query(comment_table.c.topic_id,
+                                     func.max(revision_table.c.create_time))
+        q = q.filter(revision_table.c.comment_id == comment_table.c.id)
+        q = q.filter(comment_table.c.topic_id.in_(topic_ids))
+        q = q.group_by(comment_table.c.topic_id)
+        return dict(q)
+
+    def _prime_tallies(self, polls):
+        '''
+        Load the latest tally of each poll and put it where
+        :attr:`adhocracy.model.Poll.tally` looks first.
+        '''
+        polls = dict((p.id, p) for p in polls if p._tally is None)
+        if not polls:
+            return
+        tally_table = model.tally_table
+        latest = model.meta.Session.query(
+            tally_table.c.poll_id,
+            func.max(tally_table.c.create_time).label('create_time'))
+        latest = latest.filter(tally_table.c.poll_id.in_(polls.keys()))
+        latest = latest.group_by(tally_table.c.poll_id).subquery()
+        q = model.meta.Session.query(model.Tally)
+        q = q.join((latest, and_(
+            model.Tally.poll_id == latest.c.poll_id,
+            model.Tally.create_time == latest.c.create_time)))
+        for tally in q:
+            polls[tally.poll_id]._tally = tally
+
+
+@contextmanager
+def gathered(entities):
+    '''
+    Gather the facts about *entities* for the indexers called in the
+    block.
+    '''
+    previous = current()
+    _local.facts = IndexFacts(entities)
+    try:
+        yield _local.facts
+    finally:
+        _local.facts = previous
+
+
+def current():
+    return getattr(_local, 'facts', None)
+
+
+def comment_count(delegateable):
+    '''
+    The number of comments on *delegateable*, including deleted ones.
+    '''
+    facts = current()
+    if facts is None or delegateable.id not in facts.delegateable_ids:
+        return len(delegateable.comments)
+    return facts.comment_counts.get(delegateable.id, 0)
+
+
+def newest_comment_time(proposal):
+    '''
+    The time of the newest comment revision on the description of
+    *proposal*, or None if it has no live comments.
+    '''
+    facts = current()
+    if facts is None or proposal.id not in facts.proposal_ids:
+        if proposal.comment_count() > 0:
+            return proposal.find_latest_comment_time()
+        return None
+    if not facts.live_comment_counts.get(proposal.description_id):
+        return None
+    return facts.newest_comment_times.get(proposal.description_id,
+                                          proposal.description.create_time)
+
+
+def user_activity(instance, user):
+    facts = current()
+    if facts is None or user.id not in facts.user_ids:
+        return stats.user_activity(instance, user)
+    return facts.user_activities.get((user.id, instance.id), 0)
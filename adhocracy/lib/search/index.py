@@ -1,5 +1,10 @@
 import hashlib
 import logging
+import os
+from StringIO import StringIO
+import threading
+from time import time
+from urlparse import urljoin
 
 from httplib2 import Http
 from pylons import tmpl_context as c
@@ -7,6 +12,7 @@ from pylons import config
 from sunburnt import SolrInterface
 
 from adhocracy import model
+from adhocracy.lib.search import facts
 from adhocracy.model import refs
 
 log = logging.getLogger(__name__)
@@ -15,19 +21,108 @@ ADD = 'add'
 DELETE = 'delete'
 IGNORE = 'ignore'
 
+_writer = None
+_pool = None
+_thread = threading.local()
+# solr url -> schema.xml
+_schemas = {}
+
+
+class ConnectionPool(object):
+    """
+    Hands out search connections to one user at a time and keeps up to
+    ``size`` idle ones for reuse, so their HTTP connections stay alive.
+    Connections are created with ``factory`` when none is idle.
+    """
+
+    def __init__(self, factory, size=8):
+        self.factory = factory
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self.factory()
+
+    def release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(connection)
+
+
+def connection_pool():
+    """
+    The process wide :class:`ConnectionPool`, sized with
+    ``adhocracy.solr.pool_size``.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(make_connection,
+                               int(config.get('adhocracy.solr.pool_size', 8)))
+    return _pool
+
 
 def get_sunburnt_connection():
+    """
+    The search connection of the current request, taken from the
+    :func:`connection_pool` and returned by :func:`release_connection`.
+    Outside of requests (queue worker, paster commands, tests) every
+    thread keeps one connection.
+    """
     try:
         connection = c.sunburnt_connection
     except TypeError:
         # no tmpl_context. probably running in tests
-        return make_connection()
+        connection = getattr(_thread, 'connection', None)
+        if connection is None:
+            connection = _thread.connection = connection_pool().acquire()
+        return connection
     if not connection:
-        c.sunburnt_connection = make_connection()
+        c.sunburnt_connection = connection_pool().acquire()
     return c.sunburnt_connection
 
 
+def release_connection():
+    """ Return the connection of the current request to the pool. """
+    try:
+        connection = c.sunburnt_connection
+    except TypeError:
+        return
+    if connection:
+        c.sunburnt_connection = None
+        connection_pool().release(connection)
+
+
+def _schemadoc(solr_url, http_connection):
+    """
+    The schema of the solr at *solr_url*, fetched only once per process.
+    """
+    if solr_url not in _schemas:
+        response, content = http_connection.request(
+            urljoin(solr_url, SolrInterface.remote_schema_file))
+        if response.status != 200:
+            # let sunburnt try again and report the error
+            return None
+        _schemas[solr_url] = content
+    return StringIO(_schemas[solr_url])
+
+
 def make_connection():
+    '''
+    Connect to the search backend configured with
+    ``adhocracy.search.backend``: ``solr`` (the default) at
+    ``adhocracy.solr.url`` or the embedded
+    :class:`~adhocracy.lib.search.local.LocalSearchInterface` at
+    ``adhocracy.search.local_path``.
+    '''
+    if config.get('adhocracy.search.backend', 'solr') == 'local':
+        from adhocracy.lib.search.local import LocalSearchInterface
+        return LocalSearchInterface(config.get(
+            'adhocracy.search.local_path',
+            os.path.join(config['cache_dir'], 'search.db')))
     solr_url = config.get('adhocracy.solr.url',
                           'http://localhost:8983/solr/')
     solr_url = solr_url.strip()
@@ -35,6 +130,7 @@ def make_connection():
         solr_url = solr_url + '/'
     http_connection = Http()
     return SolrInterface(solr_url,
+                         schemadoc=_schemadoc(solr_url, http_connection),
                          http_connection=http_connection)
 
 
@@ -43,7 +139,157 @@ def gen_id(entity):
     return hashlib.sha1(ref).hexdigest()
 
 
+class IndexWriter(object):
+    """
+    Collects documents to add and ids to delete and sends them to solr
+    in one request each when :meth:`flush` is called and either
+    ``batch_size`` updates are waiting or the oldest one waits for
+    ``flush_interval`` seconds. Instead of an explicit commit, solr is
+    asked to make the changes visible within ``commit_within``
+    milliseconds (with 0, a soft commit is sent after each flush). Only
+    the last update of a document is sent.
+    An entity that cannot be indexed is logged and skipped; the rest of
+    its batch is still sent.
+
+    Entities passed to :meth:`add_entity` are only turned into documents
+    when the writer is flushed, all at once with :func:`facts.gathered`.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=10, commit_within=1000,
+                 max_retries=3):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.commit_within = commit_within
+        self.max_retries = max_retries
+        self.failures = 0
+        self.adds = {}
+        self.deletes = set()
+        self.entity_refs = {}
+        self.since = None
+        self.connection = None
+
+    def __len__(self):
+        return len(self.adds) + len(self.deletes) + len(self.entity_refs)
+
+    def _pending(self):
+        if self.since is None:
+            self.since = time()
+
+    def add_entity(self, entity):
+        self._pending()
+        index_id = gen_id(entity)
+        self.adds.pop(index_id, None)
+        self.deletes.discard(index_id)
+        self.entity_refs[index_id] = refs.to_ref(entity)
+
+    def add(self, data):
+        self._pending()
+        self.entity_refs.pop(data['id'], None)
+        self.deletes.discard(data['id'])
+        self.adds[data['id']] = data
+
+    def delete(self, index_id):
+        self._pending()
+        self.entity_refs.pop(index_id, None)
+        self.adds.pop(index_id, None)
+        self.deletes.add(index_id)
+
+    def _build_docs(self):
+        entities = refs.to_entities(self.entity_refs.values())
+        try:
+            with facts.gathered(entities):
+                self._build_entity_docs(entities)
+        except Exception, e:
+            # the indexers fall back to querying every entity
+            log.exception(e)
+            self._build_entity_docs(entities)
+        # entities that no longer exist or could not be indexed
+        self.entity_refs = {}
+
+    def _build_entity_docs(self, entities):
+        for entity in entities:
+            if gen_id(entity) not in self.entity_refs:
+                continue
+            try:
+                (action, data) = get_update_information(entity)
+            except Exception, e:
+                log.exception(e)
+                continue
+            if action == ADD:
+                self.add(data)
+            elif action in (DELETE, SKIP):
+                self.delete(data)
+
+    def flush(self, force=False):
+        """
+        Send the buffered updates if it is time to. If solr fails they
+        are kept and sent again after ``flush_interval`` seconds, up to
+        ``max_retries`` times.
+        """
+        if not len(self):
+            return
+        due = time() - self.since >= self.flush_interval
+        if not force and (self.failures or len(self) < self.batch_size) \
+                and not due:
+            return
+        if self.entity_refs:
+            self._build_docs()
+        adds, deletes = self.adds.values(), list(self.deletes)
+        kwargs = {}
+        if self.commit_within:
+            kwargs['commitWithin'] = self.commit_within
+        try:
+            if self.connection is None:
+                self.connection = connection_pool().acquire()
+            if adds:
+                self.connection.add(adds, **kwargs)
+            if deletes:
+                self.connection.delete(deletes, **kwargs)
+            if not self.commit_within:
+                self.connection.commit(softCommit=True)
+        except Exception, e:
+            log.exception(e)
+            self.failures += 1
+            if self.failures <= self.max_retries:
+                self.since = time()
+                return
+            log.error("Dropping %s documents and %s deletions after %s "
+                      "failed attempts to send them to solr: %s" %
+                      (len(adds), len(deletes), self.failures,
+                       ', '.join(sorted(self.adds.keys() + deletes))))
+        else:
+            log.debug("Sent %s documents and %s deletions to solr" %
+                      (len(adds), len(deletes)))
+        self.adds, self.deletes, self.since = {}, set(), None
+        self.failures = 0
+
+
+def start_buffering():
+    """
+    Make :func:`update` and :func:`delete` buffer their changes in an
+    :class:`IndexWriter` until :func:`flush_buffer` sends them. Meant for
+    the queue worker; configured with ``adhocracy.solr.batch_size``,
+    ``adhocracy.solr.flush_interval`` and ``adhocracy.solr.commit_within``.
+    """
+    global _writer
+    if _writer is None:
+        _writer = IndexWriter(
+            int(config.get('adhocracy.solr.batch_size', 100)),
+            int(config.get('adhocracy.solr.flush_interval', 10)),
+            int(config.get('adhocracy.solr.commit_within', 1000)))
+
+
+def flush_buffer(force=False):
+    if _writer is not None:
+        _writer.flush(force=force)
+
+
 def update(entity):
+    if _writer is not None:
+        if isinstance(entity, model.meta.Indexable):
+            _writer.add_entity(entity)
+        return
+
     (action, data) = get_update_information(entity)
     if action == IGNORE:
         return
@@ -72,6 +318,10 @@ def get_update_information(entity):
 
 
 def delete(entity):
+    if _writer is not None:
+        _writer.delete(gen_id(entity))
+        return
+
     connection = get_sunburnt_connection()
     try:
         index_id = gen_id(entity)
@@ -85,4 +335,3 @@ def clear():
     connection = get_sunburnt_connection()
     connection.delete_all()
     connection.commit()
-    connection.close()
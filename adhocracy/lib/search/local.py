@@ -0,0 +1,317 @@
+'''
+An embedded search backend that keeps the index in a SQLite database
+instead of solr, for development and small installations. Enable it with
+``adhocracy.search.backend = local``; the database is stored in
+``adhocracy.search.local_path``.
+
+:class:`LocalSearchInterface` implements the part of
+:class:`sunburnt.SolrInterface` adhocracy uses: adding and deleting
+documents and queries with ``filter``, ``query``, ``Q``, ``facet_by``,
+``paginate``, ``sort_by`` and ``execute``. Fields are handled like in
+``solr/schema.xml``: ``title`` and ``body`` (and ``text``, which they
+are copied to together with ``tag`` and ``user``) are split into
+lowercased words, all other fields match whole values. A value ending
+with ``*`` matches as a prefix.
+'''
+import json
+import re
+import sqlite3
+
+TEXT_FIELDS = ('title', 'body', 'text')
+COPY_TO_TEXT = ('title', 'body', 'tag', 'user')
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, doc TEXT)',
+    'CREATE TABLE IF NOT EXISTS terms (id TEXT, field TEXT, term TEXT)',
+    'CREATE INDEX IF NOT EXISTS terms_term ON terms (field, term)',
+    'CREATE INDEX IF NOT EXISTS terms_id ON terms (id)']
+
+
+def _values(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return [v for v in value if v is not None]
+    return [value]
+
+
+def _terms(doc):
+    '''
+    Yield the (field, term) pairs under which *doc* can be found.
+    '''
+    for field, value in doc.items():
+        for v in _values(value):
+            if field in TEXT_FIELDS:
+                for word in WORD.findall(unicode(v).lower()):
+                    yield (field, word)
+            else:
+                yield (field, unicode(v))
+        if field in COPY_TO_TEXT:
+            for v in _values(value):
+                for word in WORD.findall(unicode(v).lower()):
+                    yield ('text', word)
+
+
+class LocalQ(object):
+    '''
+    A condition tree: ``('term', field, value)``, ``('and', [...])``
+    or ``('or', [...])``.
+    '''
+
+    def __init__(self, node):
+        self.node = node
+
+    def __and__(self, other):
+        return LocalQ(('and', [self.node, other.node]))
+
+    def __or__(self, other):
+        return LocalQ(('or', [self.node, other.node]))
+
+
+def _kwargs_node(kwargs):
+    return ('and', [('term', field, value)
+                    for (field, value) in kwargs.items()])
+
+
+class Faceter(dict):
+    ''' Takes the facet options sunburnt accepts (they are ignored). '''
+
+
+class Result(object):
+
+    def __init__(self, numFound, docs):
+        self.numFound = numFound
+        self.docs = docs
+
+
+class FacetCounts(object):
+
+    def __init__(self, facet_fields):
+        self.facet_fields = facet_fields
+
+
+class Response(object):
+
+    def __init__(self, result, facet_counts):
+        self.result = result
+        self.facet_counts = facet_counts
+
+
+class LocalSearch(object):
+    '''
+    A query against a :class:`LocalSearchInterface`. Like sunburnt's
+    ``SolrSearch``, every method returns a modified copy.
+    '''
+
+    def __init__(self, interface):
+        self.interface = interface
+        self.conditions = []
+        self.facet_fields = []
+        self.faceter = Faceter()
+        self.start = 0
+        self.rows = None
+        self.sort_fields = []
+
+    def clone(self):
+        other = LocalSearch(self.interface)
+        other.conditions = list(self.conditions)
+        other.facet_fields = list(self.facet_fields)
+        other.faceter = Faceter(self.faceter)
+        other.start = self.start
+        other.rows = self.rows
+        other.sort_fields = list(self.sort_fields)
+        return other
+
+    def Q(self, **kwargs):
+        return LocalQ(_kwargs_node(kwargs))
+
+    def query(self, *args, **kwargs):
+        other = self.clone()
+        other.conditions.extend(q.node for q in args)
+        if kwargs:
+            other.conditions.append(_kwargs_node(kwargs))
+        return other
+
+    filter = query
+
+    def facet_by(self, field, **kwargs):
+        other = self.clone()
+        other.facet_fields.append(field)
+        return other
+
+    def paginate(self, start=None, rows=None):
+        other = self.clone()
+        if start is not None:
+            other.start = int(start)
+        if rows is not None:
+            other.rows = int(rows)
+        return other
+
+    def sort_by(self, field):
+        other = self.clone()
+        other.sort_fields.append(field)
+        return other
+
+    def ids(self):
+        return self.interface.matching_ids(('and', self.conditions))
+
+    def execute(self):
+        ids = self.ids()
+        docs = self.interface.load(ids)
+        for field in reversed(self.sort_fields):
+            reverse = field.startswith('-')
+            field = field.lstrip('+-')
+            docs.sort(key=lambda doc: _sort_key(doc, field),
+                      reverse=reverse)
+            # documents without the field go last in both directions
+            docs.sort(key=lambda doc: _sort_value(doc, field) is None)
+        facet_fields = dict((field, self.interface.facet_counts(field, docs))
+                            for field in self.facet_fields)
+        end = None if self.rows is None else self.start + self.rows
+        return Response(Result(len(docs), docs[self.start:end]),
+                        FacetCounts(facet_fields))
+
+
+def _sort_value(doc, field):
+    if field == 'order.title':
+        value = doc.get('title')
+        return value.lower() if value is not None else None
+    values = _values(doc.get(field))
+    return values[0] if values else None
+
+
+def _sort_key(doc, field):
+    value = _sort_value(doc, field)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class LocalSearchInterface(object):
+    '''
+    The subset of :class:`sunburnt.SolrInterface` used by adhocracy,
+    backed by the SQLite database at *path*. Like the solr connections it
+    may be used by one thread at a time only.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        for statement in SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def query(self, *args, **kwargs):
+        return LocalSearch(self).query(*args, **kwargs)
+
+    def Q(self, **kwargs):
+        return LocalQ(_kwargs_node(kwargs))
+
+    def add(self, docs, **kwargs):
+        if isinstance(docs, dict):
+            docs = [docs]
+        for doc in docs:
+            self._delete_ids([doc['id']])
+            self.db.execute('INSERT INTO docs (id, doc) VALUES (?, ?)',
+                            (doc['id'], json.dumps(doc)))
+            self.db.executemany(
+                'INSERT INTO terms (id, field, term) VALUES (?, ?, ?)',
+                [(doc['id'], field, term)
+                 for (field, term) in set(_terms(doc))])
+        self.db.commit()
+
+    def delete(self, docs=None, queries=None, **kwargs):
+        ids = []
+        if docs is not None:
+            if isinstance(docs, (basestring, dict)):
+                docs = [docs]
+            ids.extend(d['id'] if isinstance(d, dict) else d for d in docs)
+        if queries is not None:
+            if not isinstance(queries, (list, tuple)):
+                queries = [queries]
+            for query in queries:
+                if isinstance(query, LocalQ):
+                    ids.extend(self.matching_ids(query.node))
+                else:
+                    ids.extend(query.ids())
+        self._delete_ids(ids)
+        self.db.commit()
+
+    def delete_all(self):
+        self.db.execute('DELETE FROM docs')
+        self.db.execute('DELETE FROM terms')
+        self.db.commit()
+
+    def commit(self, *args, **kwargs):
+        self.db.commit()
+
+    def optimize(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        self.db.close()
+
+    def _delete_ids(self, ids):
+        for id_ in ids:
+            self.db.execute('DELETE FROM docs WHERE id = ?', (id_,))
+            self.db.execute('DELETE FROM terms WHERE id = ?', (id_,))
+
+    def _term_ids(self, field, value):
+        value = unicode(value)
+        if field in TEXT_FIELDS:
+            value = value.lower()
+        if value.endswith('*'):
+            prefix = value.rstrip('*')
+            prefix = (prefix.replace('\\', '\\\\').replace('%', '\\%')
+                      .replace('_', '\\_'))
+            rows = self.db.execute(
+                "SELECT id FROM terms WHERE field = ? AND term LIKE ? "
+                "ESCAPE '\\'", (field, prefix + '%'))
+        else:
+            rows = self.db.execute(
+                'SELECT id FROM terms WHERE field = ? AND term = ?',
+                (field, value))
+        return set(row[0] for row in rows)
+
+    def matching_ids(self, node):
+        '''
+        The ids of the documents matching the condition tree *node*
+        (see :class:`LocalQ`). An empty ``and`` matches everything.
+        '''
+        kind = node[0]
+        if kind == 'term':
+            return self._term_ids(node[1], node[2])
+        results = [self.matching_ids(child) for child in node[1]]
+        if kind == 'or':
+            return set().union(*results)
+        if not results:
+            return set(row[0] for row in
+                       self.db.execute('SELECT id FROM docs'))
+        return set.intersection(*results)
+
+    def load(self, ids):
+        docs = []
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows = self.db.execute(
+                'SELECT doc FROM docs WHERE id IN (%s)' %
+                ', '.join('?' * len(chunk)), chunk)
+            docs.extend(json.loads(row[0]) for row in rows)
+        docs.sort(key=lambda doc: doc['id'])
+        return docs
+
+    def facet_counts(self, field, docs):
+        '''
+        The number of *docs* for each value of *field*, including the
+        values of other documents with a count of 0, like solr does.
+        '''
+        counts = dict((row[0], 0) for row in self.db.execute(
+            'SELECT DISTINCT term FROM terms WHERE field = ?', (field,)))
+        for doc in docs:
+            for value in set(unicode(v) for v in _values(doc.get(field))):
+                counts[value] = counts.get(value, 0) + 1
+        return sorted(counts.items(), key=lambda (value, count): -count)
@@ -26,11 +26,11 @@ from adhocracy.model.group import Group, group_table
 from adhocracy.model.permission import (Permission, group_permission_table,
                                         permission_table)
 from adhocracy.model.delegateable import (Delegateable, delegateable_table,
-                                          category_graph)
+                                          category_graph, ScopeIndex)
 from adhocracy.model.delegation import Delegation, delegation_table
 from adhocracy.model.proposal import Proposal, proposal_table
 from adhocracy.model.poll import Poll, poll_table
-from adhocracy.model.vote import Vote, vote_table
+from adhocracy.model.vote import Vote, VoteRecord, vote_table
 from adhocracy.model.revision import Revision, revision_table
 from adhocracy.model.comment import Comment, comment_table
 from adhocracy.model.instance import Instance, instance_table
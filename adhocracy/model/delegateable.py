@@ -54,17 +54,32 @@ class Delegateable(meta.Indexable):
         return u"<Delegateable(%d,%s)>" % (self.id, self.instance.key)
 
     def is_super(self, delegateable):
-        if delegateable in self.children:
-            return True
-        for child in self.children:
-            r = child.is_super(delegateable)
-            if r:
-                return True
-        return False
+        return ScopeIndex.for_instance(self.instance_id).is_super(
+            self.id, delegateable.id)
 
     def is_sub(self, delegateable):
         return delegateable.is_super(self)
 
+    def descendant_ids(self):
+        """
+        The ids of all delegateables that are reachable through
+        ``children``, not including this delegateable itself.
+        """
+        return ScopeIndex.for_instance(self.instance_id).descendant_ids(
+            self.id)
+
+    @classmethod
+    def category_edges(cls, instance_id):
+        """
+        All rows of the ``category_graph`` within an instance as a list of
+        ``(parent_id, child_id)`` tuples.
+        """
+        q = meta.Session.query(category_graph.c.parent_id,
+                               category_graph.c.child_id)
+        q = q.filter(category_graph.c.child_id == Delegateable.id)
+        q = q.filter(Delegateable.instance_id == instance_id)
+        return q.all()
+
     def is_mutable(self):
         return True
 
@@ -240,3 +255,85 @@ class Delegateable(meta.Indexable):
             user=self.creator.user_name
             ))
         return index
+
+
+class ScopeIndex(object):
+    """
+    The ``category_graph`` of one instance held in memory. It maps every
+    delegateable to its ancestors so that questions like
+    :meth:`Delegateable.is_super` are answered by set lookups.
+
+    Indexes are kept on the current session (i.e. per request or per
+    queue message) and dropped by :func:`invalidate_scope_index` whenever
+    a flush touches a ``Delegateable``.
+
+    :param instance_id: The id of the ``Instance`` to index.
+    """
+
+    def __init__(self, instance_id):
+        self.instance_id = instance_id
+        # id -> [id], mirrors ``Delegateable.parents``
+        self.parents = {}
+        # id -> [id], mirrors ``Delegateable.children``
+        self.children = {}
+        for parent_id, child_id in Delegateable.category_edges(instance_id):
+            self.parents.setdefault(parent_id, []).append(child_id)
+            self.children.setdefault(child_id, []).append(parent_id)
+        self._ancestors = None
+        self._descendants = {}
+
+    @classmethod
+    def for_instance(cls, instance_id):
+        session = meta.Session()
+        if session.autoflush:
+            # like a query would, so pending changes drop the index
+            session.flush()
+        index = getattr(session, '_scope_indexes', {}).get(instance_id)
+        if index is None:
+            # loading may autoflush and invalidate, so store it afterwards
+            index = cls(instance_id)
+            if not hasattr(session, '_scope_indexes'):
+                session._scope_indexes = {}
+            session._scope_indexes[instance_id] = index
+        return index
+
+    def _closure(self, edges, id):
+        reached = set()
+        stack = list(edges.get(id, []))
+        while stack:
+            id = stack.pop()
+            if id in reached:
+                continue
+            reached.add(id)
+            stack.extend(edges.get(id, []))
+        return reached
+
+    def descendant_ids(self, id):
+        """
+        Ids of all delegateables reachable through ``children``.
+        """
+        if id not in self._descendants:
+            self._descendants[id] = self._closure(self.children, id)
+        return self._descendants[id]
+
+    def ancestor_ids(self, id):
+        """
+        Ids of all delegateables that have ``id`` among their descendants.
+        """
+        if self._ancestors is None:
+            # ``parents`` is the inverse of ``children``
+            self._ancestors = dict((child_id, self._closure(self.parents,
+                                                            child_id))
+                                   for child_id in self.parents)
+        return self._ancestors.get(id, set())
+
+    def is_super(self, id, other_id):
+        return id in self.ancestor_ids(other_id)
+
+
+def invalidate_scope_index(session):
+    """
+    Drop the cached :class:`ScopeIndex` objects of a session.
+    """
+    if hasattr(session, '_scope_indexes'):
+        del session._scope_indexes
@@ -148,3 +148,12 @@ class Delegation(object):
             self.agent.user_name,
             self.scope.id
         )
+
+
+def invalidate_delegation_graphs(session):
+    """
+    Drop the :class:`adhocracy.lib.democracy.DelegationGraph` objects
+    cached on a session.
+    """
+    if hasattr(session, '_delegation_graphs'):
+        del session._delegation_graphs
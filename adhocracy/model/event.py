@@ -94,6 +94,17 @@ class Event(object):
             log.warn("find(%s): %s" % (id, e))
             return None
 
+    @classmethod
+    def find_all(cls, ids, instance_filter=True):
+        if not len(ids):
+            return []
+        q = meta.Session.query(Event)
+        q = q.filter(Event.id.in_(ids))
+        if ifilter.has_instance() and instance_filter:
+            q = q.filter(Event.instance_id == ifilter.get_instance().id)
+        q = q.order_by(Event.id)
+        return q.all()
+
     @classmethod
     def find_by_topics(cls, topics, limit=None):
         from delegateable import Delegateable
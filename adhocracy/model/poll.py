@@ -191,11 +191,7 @@ class Poll(object):
 
     @classmethod
     def within_scope(cls, scope):
-        def _crawl(scope):
-            l = [scope]
-            [l.extend(_crawl(c)) for c in scope.children]
-            return l
-        scope_ids = [s.id for s in _crawl(scope)]
+        scope_ids = [scope.id] + list(scope.descendant_ids())
         q = meta.Session.query(Poll)
         q = q.filter(Poll.scope_id.in_(scope_ids))
         q = q.filter(or_(Poll.end_time == None,
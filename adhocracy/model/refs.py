@@ -18,6 +18,7 @@ import re
 import base64
 
 from pylons.i18n import _
+from sqlalchemy.orm.attributes import instance_state
 
 from comment import Comment
 from delegation import Delegation
@@ -33,7 +34,7 @@ from tag import Tag
 from tagging import Tagging
 from text import Text
 from user import User
-from vote import Vote
+from vote import Vote, VoteRecord
 from milestone import Milestone
 
 
@@ -107,6 +108,8 @@ def to_ref(entity):
     Returns a `unicode` string reference if one can be generated
     or the passed in `entity` object if not.
     '''
+    if isinstance(entity, VoteRecord):
+        return u"@[%s:%s]" % (cls_type(Vote), entity.id)
     for cls in TYPES:
         if isinstance(entity, cls):
             return u"@[%s:%s]" % (entity_type(entity),
@@ -114,6 +117,25 @@ def to_ref(entity):
     return None
 
 
+def to_cache_key(entity):
+    '''Return a stable string for a model object to build cache keys
+    and tags from, in the format `<entity_type>:<primary key>`.
+    Unlike :func:`to_ref` this never touches attributes that may need
+    to be loaded: the primary key is taken from the identity key of the
+    persistent object, so the same row always maps to the same string.
+    Returns `None` for objects that are not mapped or not yet flushed.
+    '''
+    if isinstance(entity, VoteRecord):
+        return u"%s:%s" % (cls_type(Vote), entity.id)
+    try:
+        key = instance_state(entity).key
+    except AttributeError:
+        return None
+    if key is None:
+        return None
+    return u"%s:%s" % (entity_type(entity), u":".join(map(unicode, key[1])))
+
+
 def to_id(ref):
     match = FORMAT.match(unicode(ref))
     return match.group(2) if match else None
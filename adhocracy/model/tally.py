@@ -1,8 +1,10 @@
 from datetime import datetime
+from itertools import groupby
 import logging
 from sets import Set
 
 from sqlalchemy import Table, Column, Integer, ForeignKey, DateTime
+from sqlalchemy.orm import eagerload
 
 import meta
 
@@ -54,14 +56,89 @@ class Tally(object):
     score = property(_get_score)
 
     @classmethod
-    def create_from_vote(cls, vote):
+    def create_from_vote(cls, vote, incremental=False):
         tally = cls.find_by_vote(vote)
         if tally is None:
-            tally = Tally.create_from_poll(vote.poll, vote.create_time)
+            if incremental:
+                tally = cls.create_incremental(vote)
+            if tally is None:
+                tally = Tally.create_from_poll(vote.poll, vote.create_time)
             tally.vote = vote
             meta.Session.flush()
         return tally
 
+    @classmethod
+    def create_incremental(cls, vote):
+        """
+        Create the tally for a newly cast vote by applying the change of
+        the voter's decision to the previous tally of the poll instead of
+        recounting every decision.
+
+        Votes cast via delegation are stored as votes of the principals.
+        The votes of all principals are inserted with the same
+        ``create_time`` (see :meth:`Vote.create_many`), so all votes cast
+        at the time of ``vote`` are applied as one step and get a tally
+        each. Their own updates then find that tally and don't recount.
+
+        :returns: the new ``Tally`` or ``None`` if the previous tally
+            cannot be used as a base. Callers should fall back to
+            :meth:`create_from_poll` in this case.
+        """
+        from adhocracy.lib.democracy import Decision
+        from vote import Vote
+        q = meta.Session.query(Tally)
+        q = q.filter(Tally.poll_id == vote.poll_id)
+        q = q.filter(Tally.create_time <= vote.create_time)
+        q = q.order_by(Tally.create_time.desc())
+        q = q.order_by(Tally.id.desc())
+        previous = q.limit(1).first()
+        if previous is None or previous.create_time >= vote.create_time:
+            return None
+
+        # the delta is only known if all votes that were cast since the
+        # previous tally was taken belong to the same step as this vote.
+        q = meta.Session.query(Vote.id, Vote.user_id, Vote.create_time)
+        q = q.filter(Vote.poll_id == vote.poll_id)
+        q = q.filter(Vote.create_time > previous.create_time)
+        q = q.filter(Vote.create_time <= vote.create_time)
+        step = q.all()
+        if any(create_time != vote.create_time
+               for (_, _, create_time) in step):
+            return None
+        step_ids = set(id_ for (id_, _, _) in step)
+
+        results = {Vote.YES: previous.num_for,
+                   Vote.NO: previous.num_against,
+                   Vote.ABSTAIN: previous.num_abstain}
+        for after in Decision.for_poll(vote.poll, at_time=vote.create_time,
+                                       user_ids=set(u for (_, u, _) in step)):
+            before = Decision(after.user, after.poll, at_time=after.at_time,
+                              votes=[v for v in after.votes
+                                     if v.id not in step_ids])
+            if before.result is not None:
+                results[before.result] -= 1
+            if after.result is not None:
+                results[after.result] += 1
+        tally = Tally(vote.poll,
+                      results[Vote.YES],
+                      results[Vote.NO],
+                      results[Vote.ABSTAIN])
+        tally.create_time = vote.create_time
+        meta.Session.add(tally)
+
+        # no other vote of the step has a tally yet, as none was taken
+        # at the step's time.
+        others = step_ids - set([vote.id])
+        if others:
+            meta.Session.execute(tally_table.insert(), [
+                dict(create_time=vote.create_time, poll_id=vote.poll_id,
+                     vote_id=vote_id, num_for=tally.num_for,
+                     num_against=tally.num_against,
+                     num_abstain=tally.num_abstain)
+                for vote_id in others])
+        meta.Session.flush()
+        return tally
+
     @classmethod
     def create_from_poll(cls, poll, at_time=None):
         from adhocracy.lib.democracy import Decision
@@ -82,6 +159,130 @@ class Tally(object):
         meta.Session.flush()
         return tally
 
+    @classmethod
+    def replay(cls, poll, interval=None, end_time=None):
+        """
+        Replay the history of a poll. The votes are read once, in the
+        order in which they were cast, and the current decision of every
+        voter is kept while going through them, so the cost is linear in
+        the number of votes.
+
+        :param interval: A ``timedelta``. If given, a snapshot is taken
+            at the begin of the poll and every ``interval`` after it until
+            ``end_time``. Otherwise a snapshot is taken for every vote,
+            like :meth:`create_from_vote` does.
+        :param end_time: The time up to which snapshots are taken in
+            interval mode, defaults to the end of the poll or now.
+        :returns: generator of ``Tally`` objects which are not added to
+            the session. ``poll_id`` and, for vote snapshots, ``vote_id``
+            are set.
+        """
+        from adhocracy.lib.democracy import Decision
+        from vote import Vote
+        q = meta.Session.query(Vote)
+        q = q.filter(Vote.poll_id == poll.id)
+        q = q.options(eagerload(Vote.delegation), eagerload(Vote.user))
+        q = q.order_by(Vote.create_time.asc(), Vote.id.asc())
+
+        results = {Vote.YES: 0, Vote.NO: 0, Vote.ABSTAIN: 0}
+        user_votes = {}
+        user_results = {}
+
+        def snapshot(create_time, vote=None):
+            tally = Tally(None,
+                          results[Vote.YES],
+                          results[Vote.NO],
+                          results[Vote.ABSTAIN])
+            tally.poll_id = poll.id
+            tally.vote_id = vote.id if vote is not None else None
+            tally.create_time = create_time
+            return tally
+
+        if interval is not None:
+            next_sample = poll.begin_time
+            if end_time is None:
+                end_time = poll.end_time or datetime.utcnow()
+
+        for create_time, votes in groupby(q, lambda v: v.create_time):
+            votes = list(votes)
+            if interval is not None:
+                while next_sample < create_time and next_sample <= end_time:
+                    yield snapshot(next_sample)
+                    next_sample += interval
+            for vote in votes:
+                # Decision expects the votes of a user newest first
+                votes_ = [vote] + user_votes.get(vote.user_id, [])
+                votes_.sort(key=lambda v: v.id, reverse=True)
+                user_votes[vote.user_id] = votes_
+                old = user_results.get(vote.user_id)
+                new = Decision(vote.user, poll, votes=votes_).result
+                if old is not None:
+                    results[old] -= 1
+                if new is not None:
+                    results[new] += 1
+                user_results[vote.user_id] = new
+            if interval is None:
+                for vote in votes:
+                    yield snapshot(create_time, vote)
+
+        if interval is not None:
+            while next_sample <= end_time:
+                yield snapshot(next_sample)
+                next_sample += interval
+
+    @classmethod
+    def backfill(cls, poll, replace=False):
+        """
+        Create the tallies for all votes of a poll that do not have one
+        yet, using :meth:`replay`.
+
+        :param replace: Also correct the numbers of existing tallies,
+            e.g. after a data fix.
+        :returns: the number of created or changed tallies
+        """
+        q = meta.Session.query(Tally)
+        q = q.filter(Tally.poll_id == poll.id)
+        q = q.filter(Tally.vote_id != None)
+        existing = dict((t.vote_id, t) for t in q)
+        changed = 0
+        for sample in cls.replay(poll):
+            tally = existing.get(sample.vote_id)
+            if tally is None:
+                tally = Tally(poll, sample.num_for, sample.num_against,
+                              sample.num_abstain)
+                tally.vote_id = sample.vote_id
+                tally.create_time = sample.create_time
+                meta.Session.add(tally)
+                changed += 1
+            elif replace and (tally.num_for, tally.num_against,
+                              tally.num_abstain) != (
+                    sample.num_for, sample.num_against, sample.num_abstain):
+                tally.num_for = sample.num_for
+                tally.num_against = sample.num_against
+                tally.num_abstain = sample.num_abstain
+                changed += 1
+        meta.Session.flush()
+        return changed
+
+    @classmethod
+    def backfill_instance(cls, instance, replace=False, batch_size=100):
+        """
+        :meth:`backfill` the tallies of all polls in an instance. The
+        polls are loaded in batches of ``batch_size``.
+
+        :returns: generator of the number of created or changed tallies
+            per batch, so the caller can commit between batches.
+        """
+        from delegateable import Delegateable
+        from poll import Poll
+        q = meta.Session.query(Poll.id).join(Delegateable, Poll.scope)
+        q = q.filter(Delegateable.instance_id == instance.id)
+        poll_ids = [poll_id for (poll_id,) in q.order_by(Poll.id)]
+        for start in xrange(0, len(poll_ids), batch_size):
+            batch = poll_ids[start:start + batch_size]
+            polls = meta.Session.query(Poll).filter(Poll.id.in_(batch))
+            yield sum(cls.backfill(poll, replace=replace) for poll in polls)
+
     @classmethod
     def combine_polls(cls, polls, at_time=None):
         from adhocracy.lib.democracy import Decision
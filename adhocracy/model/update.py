@@ -1,4 +1,6 @@
+from itertools import chain
 import logging
+
 from sqlalchemy.orm import SessionExtension
 
 log = logging.getLogger(__name__)
@@ -10,6 +12,19 @@ UPDATE = "update"
 REGISTRY = {}
 
 
+def register_modifications(session, operation, entities):
+    '''
+    Make entities that were written without the unit of work (e.g. with
+    bulk inserts) known to the :class:`SessionModificationExtension`, so
+    that update tasks are posted for them on commit.
+    '''
+    if not hasattr(session, '_object_cache'):
+        session._object_cache = {INSERT: set(),
+                                 DELETE: set(),
+                                 UPDATE: set()}
+    session._object_cache[operation].update(entities)
+
+
 class SessionModificationExtension(SessionExtension):
     '''
     A sqlalchemy SessionExtension to do work before commit, like
@@ -17,13 +32,25 @@ class SessionModificationExtension(SessionExtension):
     '''
 
     def before_flush(self, session, flush_context, instances):
-        if not hasattr(session, '_object_cache'):
-            session._object_cache = {INSERT: set(),
-                                     DELETE: set(),
-                                     UPDATE: set()}
-        session._object_cache[INSERT].update(session.new)
-        session._object_cache[DELETE].update(session.deleted)
-        session._object_cache[UPDATE].update(session.dirty)
+        from delegateable import Delegateable, invalidate_scope_index
+        from delegation import Delegation, invalidate_delegation_graphs
+        from vote import Vote
+        for entity in chain(session.new, session.dirty, session.deleted):
+            if isinstance(entity, Delegateable):
+                invalidate_scope_index(session)
+                invalidate_delegation_graphs(session)
+                break
+            if isinstance(entity, (Delegation, Vote)):
+                invalidate_delegation_graphs(session)
+        register_modifications(session, INSERT, session.new)
+        register_modifications(session, DELETE, session.deleted)
+        register_modifications(session, UPDATE, session.dirty)
+
+    def after_rollback(self, session):
+        from delegateable import invalidate_scope_index
+        from delegation import invalidate_delegation_graphs
+        invalidate_scope_index(session)
+        invalidate_delegation_graphs(session)
 
     def before_commit(self, session):
         from adhocracy.lib import cache
@@ -38,11 +65,12 @@ class SessionModificationExtension(SessionExtension):
 
         #for entity in session._object_cache[INSERT]:
 
-        for entity in session._object_cache[UPDATE]:
-            cache.invalidate(entity)
+        with cache.batch_invalidation():
+            for entity in session._object_cache[UPDATE]:
+                cache.invalidate(entity)
 
-        for entity in session._object_cache[DELETE]:
-            cache.invalidate(entity)
+            for entity in session._object_cache[DELETE]:
+                cache.invalidate(entity)
 
         del session._object_cache
 
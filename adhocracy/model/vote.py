@@ -1,7 +1,7 @@
 from datetime import datetime
 import logging
 
-from sqlalchemy import Table, Column, Integer, ForeignKey, DateTime
+from sqlalchemy import Table, Column, Integer, ForeignKey, DateTime, func
 
 import meta
 import instance_filter as ifilter
@@ -49,6 +49,51 @@ class Vote(object):
             #log.warn("find(%s): %s" % (id, e))
             return None
 
+    @classmethod
+    def create_many(cls, poll, orientation, edges, create_time=None):
+        """
+        Insert votes for many users with a single ``executemany`` instead
+        of adding one ``Vote`` object per user to the session.
+
+        :param edges: A list of ``(User, Delegation)`` tuples. The
+            ``Delegation`` is ``None`` for direct votes.
+        :returns: a list of :class:`VoteRecord`
+        """
+        from delegation import invalidate_delegation_graphs
+        from update import INSERT, register_modifications
+        if create_time is None:
+            create_time = datetime.utcnow()
+        if not edges:
+            return []
+        meta.Session.flush()
+        # the new rows are found by their ids, which are all larger than
+        # the largest id before the insert. create_time cannot be used, as
+        # other batches may have been inserted in the same second.
+        max_id = meta.Session.query(func.max(Vote.id)).scalar() or 0
+        rows = [dict(orientation=orientation,
+                     create_time=create_time,
+                     user_id=user.id,
+                     poll_id=poll.id,
+                     delegation_id=delegation.id if delegation else None)
+                for (user, delegation) in edges]
+        meta.Session.execute(vote_table.insert(), rows)
+        invalidate_delegation_graphs(meta.Session())
+
+        q = meta.Session.query(Vote.user_id, Vote.id)
+        q = q.filter(Vote.poll_id == poll.id)
+        q = q.filter(Vote.id > max_id)
+        q = q.filter(Vote.user_id.in_([user.id for (user, _) in edges]))
+        q = q.filter(Vote.orientation == orientation)
+        # if another batch for the same users committed in between, its
+        # rows were inserted after max_id as well. Prefer the first row.
+        q = q.order_by(Vote.id.desc())
+        ids = dict(q.all())
+        records = [VoteRecord(ids[user.id], user, poll, orientation,
+                              delegation, create_time)
+                   for (user, delegation) in edges]
+        register_modifications(meta.Session(), INSERT, records)
+        return records
+
     @classmethod
     def all_q(cls):
         return meta.Session.query(Vote)
@@ -71,3 +116,46 @@ class Vote(object):
             self.poll.id,
             self.orientation,
             self.delegation.id if self.delegation else "DIRECT")
+
+
+class VoteRecord(object):
+    """
+    A lightweight stand-in for a ``Vote`` that was inserted with
+    :meth:`Vote.create_many`. It is not part of the session but can be
+    referenced (see :func:`adhocracy.model.refs.to_ref`) like a ``Vote``.
+    """
+
+    def __init__(self, id, user, poll, orientation, delegation, create_time):
+        self.id = id
+        self.user = user
+        self.user_id = user.id
+        self.poll = poll
+        self.poll_id = poll.id
+        self.orientation = orientation
+        self.delegation = delegation
+        self.delegation_id = delegation.id if delegation else None
+        self.create_time = create_time
+
+    def to_dict(self):
+        return dict(id=self.id,
+                    user=self.user_id,
+                    poll=self.poll_id,
+                    result=self.orientation,
+                    create_time=self.create_time,
+                    delegation=self.delegation_id)
+
+    def __eq__(self, other):
+        return isinstance(other, (Vote, VoteRecord)) and self.id == other.id
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return "<VoteRecord(%s,%s,%s,%s,%s)>" % (self.id,
+            self.user.user_name,
+            self.poll_id,
+            self.orientation,
+            self.delegation_id if self.delegation else "DIRECT")
@@ -161,6 +161,56 @@ class TestDecisionWithDelegation(TestController):
         Decision(self.high_delegate, self.poll).make(Vote.YES)
         self.assertEqual(self.decision.reload().result, Vote.YES)
 
+    def test_bulk_vote_is_propagated_to_principals(self):
+        from adhocracy.model import meta, refs
+        delegation = self._do_delegate(self.low_delegate,
+                                       self.high_delegate, self.proposal)
+        self._do_delegate(self.me, self.low_delegate, self.proposal)
+        votes = Decision(self.high_delegate, self.poll).make(Vote.YES,
+                                                             bulk=True)
+        self.assertEqual(len(votes), 3)
+        by_user = dict((v.user, v) for v in votes)
+        self.assertEqual(by_user[self.high_delegate].delegation, None)
+        self.assertEqual(by_user[self.low_delegate].delegation, delegation)
+        self.assertEqual(self.decision.reload().result, Vote.YES)
+        vote = Vote.find(by_user[self.me].id)
+        self.assertEqual(refs.to_ref(by_user[self.me]), refs.to_ref(vote))
+        self.assertEqual(by_user[self.me], vote)
+        self.assertTrue(by_user[self.me] in
+                        meta.Session()._object_cache['insert'])
+
+    def test_for_poll_resolves_delegated_decisions(self):
+        self._do_delegate(self.me, self.high_delegate, self.proposal)
+        Decision(self.high_delegate, self.poll).make(Vote.YES)
+        Decision(self.low_delegate, self.poll).make(Vote.NO)
+        results = dict((d.user, d.result)
+                       for d in Decision.for_poll(self.poll))
+        self.assertEqual(results, {self.me: Vote.YES,
+                                   self.high_delegate: Vote.YES,
+                                   self.low_delegate: Vote.NO})
+
+    def test_for_user_groups_votes_by_poll(self):
+        other_proposal = tt_make_proposal(voting=True)
+        other_poll = Poll.create(other_proposal, other_proposal.creator,
+                                 Poll.ADOPT)
+        self.decision.make(Vote.YES)
+        self.decision.make(Vote.NO)
+        Decision(self.me, other_poll).make(Vote.ABSTAIN)
+        decisions = dict((d.poll, d) for d in
+                         Decision.for_user(self.me, self.instance))
+        self.assertEqual(len(decisions[self.poll].votes), 2)
+        self.assertEqual(decisions[self.poll].result, Vote.NO)
+        self.assertEqual(decisions[other_poll].result, Vote.ABSTAIN)
+
+    def test_tally_counts_delegated_votes(self):
+        from adhocracy.model import Tally
+        self._do_delegate(self.me, self.high_delegate, self.proposal)
+        Decision(self.high_delegate, self.poll).make(Vote.YES)
+        Decision(self.low_delegate, self.poll).make(Vote.ABSTAIN)
+        tally = Tally.create_from_poll(self.poll)
+        self.assertEqual((tally.num_for, tally.num_against,
+                          tally.num_abstain), (2, 0, 1))
+
 
 # TODO: can access history of delegation decisions
 # TODO: test replay - this is currently in the decision -
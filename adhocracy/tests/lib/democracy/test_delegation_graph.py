@@ -0,0 +1,89 @@
+from adhocracy.lib.democracy import Decision, DelegationGraph, DelegationNode
+from adhocracy.model import Delegation, Poll, Vote
+
+from adhocracy.tests import TestController
+from adhocracy.tests.testtools import tt_get_instance
+from adhocracy.tests.testtools import tt_make_proposal, tt_make_user
+
+
+class TestDelegationGraph(TestController):
+
+    def setUp(self):
+        super(TestDelegationGraph, self).setUp()
+        self.me = tt_make_user()
+        self.first = tt_make_user()
+        self.second = tt_make_user()
+        self.third = tt_make_user()
+        self.proposal = tt_make_proposal(voting=True)
+        self.poll = Poll.create(self.proposal, self.proposal.creator,
+                                Poll.ADOPT)
+        self.instance = tt_get_instance()
+
+    def _graph(self):
+        return DelegationGraph(self.instance)
+
+    def _assert_same_as_node(self, user):
+        node = DelegationNode(user, self.proposal)
+        graph = self._graph()
+        self.assertEqual(set(node.inbound()),
+                         set(graph.inbound(user, self.proposal)))
+        self.assertEqual(set(node.outbound()),
+                         set(graph.outbound(user, self.proposal)))
+        self.assertEqual(
+            sorted(d.id for d in node.transitive_inbound()),
+            sorted(d.id for d in graph.transitive_inbound(user,
+                                                          self.proposal)))
+        self.assertEqual(
+            len(node.transitive_inbound(is_counting_delegations=True)),
+            graph.number_of_delegations(user, self.proposal))
+
+    def test_graph_without_delegations_is_empty(self):
+        graph = self._graph()
+        self.assertEqual(graph.inbound(self.me, self.proposal), [])
+        self.assertEqual(graph.outbound(self.me, self.proposal), [])
+        self.assertEqual(graph.number_of_delegations(self.me,
+                                                     self.proposal), 0)
+
+    def test_direct_and_indirect_delegations(self):
+        Delegation.create(self.first, self.me, self.proposal)
+        Delegation.create(self.second, self.first, self.proposal)
+        Delegation.create(self.third, self.me, self.proposal)
+        for user in (self.me, self.first, self.second, self.third):
+            self._assert_same_as_node(user)
+        self.assertEqual(
+            self._graph().number_of_delegations(self.me, self.proposal), 3)
+
+    def test_mutual_delegation(self):
+        Delegation.create(self.first, self.second, self.proposal)
+        Delegation.create(self.second, self.first, self.proposal)
+        Decision(self.first, self.poll).make(Vote.YES)
+        self._assert_same_as_node(self.first)
+        self._assert_same_as_node(self.second)
+
+    def test_revoked_delegations_are_not_loaded(self):
+        delegation = Delegation.create(self.first, self.me, self.proposal)
+        delegation.revoke()
+        self.assertEqual(self._graph().inbound(self.me, self.proposal), [])
+
+    def test_propagate_matches_node(self):
+        Delegation.create(self.first, self.me, self.proposal)
+        Delegation.create(self.second, self.first, self.proposal)
+        Delegation.create(self.third, self.second, self.proposal)
+
+        def record(user, delegateable, edge):
+            return user
+
+        by_node = DelegationNode(self.me, self.proposal).propagate(record)
+        by_graph = self._graph().propagate(self.me, self.proposal, record)
+        self.assertEqual(by_node, by_graph)
+        self.assertEqual(len(by_graph), 4)
+
+    def test_for_instance_is_reused_until_delegations_change(self):
+        graph = DelegationGraph.for_instance(self.instance)
+        self.assertTrue(DelegationGraph.for_instance(self.instance) is graph)
+        delegation = Delegation.create(self.first, self.me, self.proposal)
+        graph = DelegationGraph.for_instance(self.instance)
+        self.assertEqual(graph.inbound(self.me, self.proposal), [delegation])
+        delegation.revoke()
+        self.assertEqual(DelegationGraph.for_instance(self.instance).inbound(
+            self.me, self.proposal), [])
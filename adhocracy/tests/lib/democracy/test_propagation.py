@@ -0,0 +1,70 @@
+import json
+
+from mock import patch
+
+from adhocracy.lib import democracy
+from adhocracy.lib.democracy import Decision
+from adhocracy.lib.event import types
+from adhocracy.model import Delegation, Poll, Vote, refs
+
+from adhocracy.tests import TestController
+from adhocracy.tests.testtools import tt_make_proposal, tt_make_user
+
+
+class TestAsyncPropagation(TestController):
+
+    def setUp(self):
+        super(TestAsyncPropagation, self).setUp()
+        self.principal = tt_make_user()
+        self.agent = tt_make_user()
+        self.proposal = tt_make_proposal(voting=True)
+        self.poll = Poll.create(self.proposal, self.proposal.creator,
+                                Poll.ADOPT)
+        Delegation.create(self.principal, self.agent, self.proposal)
+
+    def test_make_without_propagation_casts_own_vote_only(self):
+        votes = Decision(self.agent, self.poll).make(Vote.YES,
+                                                     propagate=False)
+        self.assertEqual(len(votes), 1)
+        self.assertEqual(votes[0].user, self.agent)
+        self.assertEqual(Decision(self.principal, self.poll).result, None)
+
+    def test_propagate_vote_casts_principal_votes(self):
+        vote = Decision(self.agent, self.poll).make(Vote.NO,
+                                                    propagate=False)[0]
+        records = democracy.propagate_vote(vote)
+        self.assertEqual([r.user_id for r in records], [self.principal.id])
+        self.assertEqual(Decision(self.principal, self.poll).result, Vote.NO)
+
+    def test_handle_propagation_emits_one_event_per_vote(self):
+        vote = Decision(self.agent, self.poll).make(Vote.YES,
+                                                    propagate=False)[0]
+        message = json.dumps(dict(vote=refs.to_ref(vote),
+                                  event=unicode(types.T_VOTE_CAST)))
+        with patch('adhocracy.lib.event.emit') as emit:
+            with patch.object(democracy.meta.Session, 'commit'):
+                democracy.handle_propagation(message)
+        self.assertEqual(emit.call_count, 2)
+        self.assertEqual(set(c[0][0] for c in emit.call_args_list),
+                         set([types.T_VOTE_CAST]))
+        self.assertEqual(Decision(self.principal, self.poll).result,
+                         Vote.YES)
+
+    def test_handle_propagation_ignores_unknown_event_types(self):
+        vote = Decision(self.agent, self.poll).make(Vote.YES,
+                                                    propagate=False)[0]
+        for event in (u'no_such_event', None):
+            message = json.dumps(dict(vote=refs.to_ref(vote), event=event))
+            with patch('adhocracy.lib.event.emit') as emit:
+                democracy.handle_propagation(message)
+            self.assertFalse(emit.called)
+        self.assertEqual(Decision(self.principal, self.poll).result, None)
+
+    def test_provisional_tally(self):
+        before = self.poll.tally
+        tally = democracy.provisional_tally(self.poll, None, Vote.YES)
+        self.assertEqual(tally.num_for, before.num_for + 1)
+        self.assertEqual(tally.poll_id, self.poll.id)
+        tally = democracy.provisional_tally(self.poll, Vote.YES, Vote.NO)
+        self.assertEqual(tally.num_for, before.num_for - 1)
+        self.assertEqual(tally.num_against, before.num_against + 1)
@@ -0,0 +1,60 @@
+from mock import patch
+
+from adhocracy.lib import democracy
+from adhocracy.lib.democracy import Decision
+from adhocracy.model import Delegation, Poll, Vote
+
+from adhocracy.tests import TestController
+from adhocracy.tests.testtools import tt_make_proposal, tt_make_user
+
+
+class TestUpdateDelegation(TestController):
+
+    def setUp(self):
+        super(TestUpdateDelegation, self).setUp()
+        democracy.DIRTY_POLLS.clear()
+        self.principal = tt_make_user()
+        self.agent = tt_make_user()
+        self.proposal = tt_make_proposal(voting=True)
+        self.poll = Poll.create(self.proposal, self.proposal.creator,
+                                Poll.ADOPT)
+
+    def tearDown(self):
+        democracy.DIRTY_POLLS.clear()
+        super(TestUpdateDelegation, self).tearDown()
+
+    def test_marks_polls_in_scope_as_dirty(self):
+        delegation = Delegation.create(self.principal, self.agent,
+                                       self.proposal)
+        democracy.update_delegation(delegation)
+        democracy.update_delegation(delegation)
+        self.assertTrue(self.poll.id in democracy.DIRTY_POLLS)
+
+    def test_self_decided_principal_does_not_mark_poll(self):
+        Decision(self.principal, self.poll).make(Vote.YES)
+        delegation = Delegation.create(self.principal, self.agent,
+                                       self.proposal)
+        democracy.update_delegation(delegation)
+        self.assertFalse(self.poll.id in democracy.DIRTY_POLLS)
+
+    def test_flush_recounts_dirty_polls_once(self):
+        delegation = Delegation.create(self.principal, self.agent,
+                                       self.proposal)
+        Decision(self.agent, self.poll).make(Vote.YES)
+        democracy.update_delegation(delegation)
+        num_tallies = len(self.poll.tallies)
+        with patch.object(democracy.meta.Session, 'commit'):
+            democracy.flush_dirty_polls(force=True)
+        self.assertEqual(len(democracy.DIRTY_POLLS), 0)
+        self.assertEqual(len(self.poll.tallies), num_tallies + 1)
+        latest = max(self.poll.tallies, key=lambda t: t.id)
+        self.assertEqual(latest.num_for, 2)
+
+    def test_failed_recount_keeps_poll_dirty(self):
+        democracy.DIRTY_POLLS.add(self.poll.id)
+        with patch.object(democracy.Tally, 'create_from_poll',
+                          side_effect=ValueError()):
+            with patch.object(democracy.meta.Session, 'rollback') as rollback:
+                democracy.flush_dirty_polls(force=True)
+        self.assertTrue(self.poll.id in democracy.DIRTY_POLLS)
+        self.assertTrue(rollback.called)
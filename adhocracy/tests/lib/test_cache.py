@@ -0,0 +1,360 @@
+import shutil
+import tempfile
+
+from mock import patch
+from pylons import app_globals
+
+from adhocracy.lib.cache import util
+from adhocracy.lib.cache.backends import FileBackend, MemoryBackend
+from adhocracy.lib.cache.local import LRUCache
+from adhocracy.lib.cache.util import clear_tag, memoize
+
+from adhocracy.tests import TestController
+
+
+class DictCache(object):
+    """ The subset of ``memcache.Client`` used by ``lib.cache``. """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def get_multi(self, keys):
+        return dict((k, self.data[k]) for k in keys if k in self.data)
+
+    def set(self, key, value, time=0):
+        self.data[key] = value
+        return True
+
+    def set_multi(self, mapping, time=0):
+        self.data.update(mapping)
+        return []
+
+    def add(self, key, value, time=0):
+        if key in self.data:
+            return False
+        self.data[key] = value
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+        return True
+
+    def incr(self, key, delta=1):
+        if key not in self.data:
+            return None
+        self.data[key] += delta
+        return self.data[key]
+
+
+class TestMemoize(TestController):
+
+    def setUp(self):
+        super(TestMemoize, self).setUp()
+        self.cache = DictCache()
+        self.cache_patcher = patch.object(app_globals._current_obj(), 'cache',
+                                    self.cache)
+        self.cache_patcher.start()
+        self.local_patcher = patch.object(util, '_local', LRUCache(10))
+        self.local_patcher.start()
+        self.generations_patcher = patch.object(util, '_generations',
+                                                LRUCache(10, 60))
+        self.generations_patcher.start()
+        util.COUNTERS.clear()
+        util.CLEAR_COUNTERS.clear()
+        self.calls = []
+
+        @memoize('test_cache')
+        def compute(arg):
+            self.calls.append(arg)
+            return len(self.calls)
+
+        self.compute = compute
+
+    def tearDown(self):
+        self.cache_patcher.stop()
+        self.local_patcher.stop()
+        self.generations_patcher.stop()
+        super(TestMemoize, self).tearDown()
+
+    def test_values_are_cached(self):
+        self.assertEqual(self.compute(u'a'), 1)
+        self.assertEqual(self.compute(u'a'), 1)
+        self.assertEqual(self.compute(u'b'), 2)
+
+    def test_clear_tag_moves_to_new_generation(self):
+        self.compute(u'a')
+        self.compute(u'b')
+        size = len(self.cache.data)
+        clear_tag(u'a')
+        self.assertEqual(len(self.cache.data), size)
+        self.assertEqual(self.compute(u'a'), 3)
+        self.assertEqual(self.compute(u'b'), 2)
+
+    def test_evicted_generation_does_not_revive_stale_values(self):
+        self.compute(u'a')
+        clear_tag(u'a')
+        self.cache.data.pop(util.generation_key(util.make_tag(u'a')))
+        util._generations.flush_all()
+        with patch.object(util, 'now', return_value=util.now() + 1):
+            self.assertEqual(self.compute(u'a'), 2)
+
+    def test_local_tier_is_consulted_first(self):
+        self.compute(u'a')
+        self.cache.data.clear()
+        self.assertEqual(self.compute(u'a'), 1)
+        [counters] = util.memoize_counters().values()
+        self.assertEqual(counters['misses'], 1)
+        self.assertEqual(counters['local_hits'], 1)
+        self.assertFalse('hits' in counters)
+
+    def test_local_hit_does_not_ask_the_cache(self):
+        self.compute(u'a')
+        with patch.object(self.cache, 'get_multi') as get_multi:
+            with patch.object(self.cache, 'get') as get:
+                self.assertEqual(self.compute(u'a'), 1)
+        self.assertFalse(get_multi.called)
+        self.assertFalse(get.called)
+
+    def test_generations_of_other_processes_are_seen_after_ttl(self):
+        self.compute(u'a')
+        self.cache.incr(util.generation_key(util.make_tag(u'a')))
+        self.assertEqual(self.compute(u'a'), 1)
+        util._generations.flush_all()
+        self.assertEqual(self.compute(u'a'), 2)
+
+    def test_local_tier_follows_tag_invalidation(self):
+        self.compute(u'a')
+        clear_tag(u'a')
+        self.assertEqual(self.compute(u'a'), 2)
+
+    def test_request_scope_short_circuits_repeated_calls(self):
+        util.begin_request()
+        try:
+            self.compute(u'a')
+            with patch.object(util, 'make_key') as make_key:
+                self.assertEqual(self.compute(u'a'), 1)
+                self.assertFalse(make_key.called)
+            clear_tag(u'a')
+            self.assertEqual(self.compute(u'a'), 2)
+        finally:
+            util.end_request()
+        [counters] = util.memoize_counters().values()
+        self.assertEqual(counters['request_hits'], 1)
+
+    def test_request_scope_is_skipped_without_cache(self):
+        util.begin_request()
+        try:
+            with patch.object(app_globals._current_obj(), 'cache', None):
+                self.assertEqual(self.compute(u'a'), 1)
+                self.assertEqual(self.compute(u'a'), 2)
+        finally:
+            util.end_request()
+
+    def test_stale_value_is_served_while_another_worker_recomputes(self):
+
+        @memoize('test_grace', grace=True)
+        def compute(arg):
+            self.calls.append(arg)
+            return len(self.calls)
+
+        compute(u'a')
+        clear_tag(u'a')
+        with patch.object(util, 'acquire_lock', return_value=False):
+            self.assertEqual(compute(u'a'), 1)
+        self.assertEqual(compute(u'a'), 2)
+        [counters] = util.memoize_counters().values()
+        self.assertEqual(counters['stale_hits'], 1)
+        self.assertFalse([k for k in self.cache.data
+                          if k.startswith(util.LOCK_PREFIX)])
+
+    def test_expired_value_is_recomputed_by_the_lock_holder(self):
+
+        @memoize('test_expiring', time=10, grace=True)
+        def compute(arg):
+            self.calls.append(arg)
+            return len(self.calls)
+
+        self.assertEqual(compute(u'a'), 1)
+        util._local.flush_all()
+        with patch.object(util, 'now', return_value=util.now() + 11):
+            with patch.object(util, 'acquire_lock', return_value=False):
+                self.assertEqual(compute(u'a'), 1)
+            self.assertEqual(compute(u'a'), 2)
+
+    def test_without_grace_invalidated_values_are_recomputed(self):
+        self.compute(u'a')
+        clear_tag(u'a')
+        with patch.object(util, 'acquire_lock', return_value=False):
+            self.assertEqual(self.compute(u'a'), 2)
+        self.assertFalse([k for k in self.cache.data
+                          if k.startswith(util.LOCK_PREFIX)])
+
+    def test_latest_value_expires(self):
+
+        @memoize('test_latest', grace=True)
+        def compute(arg):
+            return arg
+
+        with patch.object(self.cache, 'set') as set_:
+            compute(u'a')
+        times = [kwargs['time'] for (args, kwargs) in set_.call_args_list]
+        # the entry itself only leaves the cache when it is invalidated
+        self.assertEqual(sorted(times), [0, util.latest_ttl()])
+
+    def test_batch_invalidation_clears_each_tag_once(self):
+        self.compute(u'a')
+        self.compute(u'b')
+        with patch.object(self.cache, 'incr') as incr:
+            with util.batch_invalidation():
+                self.assertTrue(clear_tag(u'a'))
+                with util.batch_invalidation():
+                    self.assertFalse(clear_tag(u'a'))
+                self.assertEqual(self.compute(u'a'), 1)
+            self.assertFalse(incr.called)
+        self.assertEqual(self.compute(u'a'), 3)
+        self.assertEqual(self.compute(u'b'), 2)
+
+    def test_batched_clears_increment_the_generation(self):
+        key = util.generation_key(util.make_tag(u'a'))
+        self.compute(u'a')
+        before = self.cache.get(key)
+        with util.batch_invalidation():
+            clear_tag(u'a')
+            # a clear by another process
+            self.cache.incr(key)
+        self.assertEqual(self.cache.get(key), before + 2)
+
+    def test_cache_stats(self):
+        self.compute(u'a')
+        self.compute(u'a')
+        clear_tag(u'a')
+        stats = util.cache_stats()
+        compute_stats = stats['memoize']['test_cache']
+        self.assertEqual(compute_stats['calls'], 2)
+        self.assertEqual(compute_stats['sets'], 1)
+        self.assertEqual(compute_stats['hit_rate'], 0.5)
+        self.assertTrue(compute_stats['avg_bytes'] > 0)
+        self.assertEqual(stats['clear_tag'], {'clears': 1})
+
+
+class TestLRUCache(TestController):
+
+    def test_least_recently_used_entry_is_dropped(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.size(), 2)
+
+    def test_entries_expire(self):
+        cache = LRUCache(ttl=10)
+        cache.set('a', 1, time=5)
+        with patch('adhocracy.lib.cache.local.now',
+                   return_value=util.now() + 6):
+            self.assertEqual(cache.get('a'), None)
+
+
+class BackendTests(object):
+
+    def test_get_and_set(self):
+        self.assertEqual(self.backend.get('a'), None)
+        self.backend.set('a', {'x': 1})
+        self.assertEqual(self.backend.get('a'), {'x': 1})
+        self.backend.delete('a')
+        self.assertEqual(self.backend.get('a'), None)
+
+    def test_add_and_incr(self):
+        self.assertEqual(self.backend.incr('a'), None)
+        self.assertTrue(self.backend.add('a', 1))
+        self.assertFalse(self.backend.add('a', 5))
+        self.assertEqual(self.backend.incr('a'), 2)
+        self.assertEqual(self.backend.get('a'), 2)
+
+    def test_multi(self):
+        self.backend.set_multi({'a': 1, 'b': 2})
+        self.assertEqual(self.backend.get_multi(['a', 'b', 'c']),
+                         {'a': 1, 'b': 2})
+        self.backend.delete_multi(['a'])
+        self.assertEqual(self.backend.get_multi(['a', 'b']), {'b': 2})
+        self.backend.flush_all()
+        self.assertEqual(self.backend.get_multi(['a', 'b']), {})
+
+    def test_entries_expire(self):
+        self.backend.set('a', 1, time=5)
+        with patch('adhocracy.lib.cache.backends.now',
+                   return_value=util.now() + 6):
+            with patch('adhocracy.lib.cache.local.now',
+                       return_value=util.now() + 6):
+                self.assertEqual(self.backend.get('a'), None)
+
+    def test_number_of_entries_is_bounded(self):
+        keys = ['k%s' % i for i in range(30)]
+        for i, key in enumerate(keys):
+            self.backend.set(key, i)
+        self.assertEqual(len(self.backend.get_multi(keys)), 10)
+
+
+class TestMemoryBackend(BackendTests, TestController):
+
+    def setUp(self):
+        super(TestMemoryBackend, self).setUp()
+        self.backend = MemoryBackend(10)
+
+
+class TestFileBackend(BackendTests, TestController):
+
+    def setUp(self):
+        super(TestFileBackend, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.backend = FileBackend(self.path, max_entries=10,
+                                   sweep_interval=5)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(TestFileBackend, self).tearDown()
+
+    def test_sweep_deletes_expired_files(self):
+        self.backend.set('a', 1, time=5)
+        self.backend.set('b', 2)
+        with patch('adhocracy.lib.cache.backends.now',
+                   return_value=util.now() + 6):
+            self.backend.sweep()
+        self.assertEqual(self.backend._entries(), [self.backend._file('b')])
+
+
+class TestMakeTag(TestController):
+
+    def test_model_objects_are_tagged_by_type_and_id(self):
+        from adhocracy.model import meta, refs
+        from adhocracy.tests.testtools import tt_make_user
+        user = tt_make_user()
+        meta.Session.flush()
+        self.assertEqual(refs.to_cache_key(user), u'user:%s' % user.id)
+        tag = util.make_tag(user)
+        meta.Session.expire(user)
+        self.assertEqual(util.make_tag(user), tag)
+        # the expired attributes were not loaded again
+        self.assertFalse('id' in user.__dict__)
+
+    def test_different_arguments_get_different_keys(self):
+        pairs = [((u'\u041f\u0440\u0438\u0432\u0435\u0442',),
+                  (u'\u0414\u0430',)),
+                 ((u'Stra\xdfe',), (u'Strae',)),
+                 ((u'a,b',), (u'a', u'b')),
+                 ((u'x', False), (u'x,False',)),
+                 ((u'1',), (1,)),
+                 (((u'a',),), ([u'a'],))]
+        for first, second in pairs:
+            self.assertNotEqual(util.make_key('iden', first, {}),
+                                util.make_key('iden', second, {}))
+
+    def test_unflushed_objects_fall_back_to_their_representation(self):
+        from adhocracy.model import Tag, refs
+        self.assertEqual(refs.to_cache_key(Tag(u'fresh')), None)
+        self.assertEqual(refs.to_cache_key(u'text'), None)
@@ -1,6 +1,51 @@
+from mock import patch
+
+from adhocracy.lib import event
+from adhocracy.model import Event, meta
+
 from adhocracy.tests import TestController
+from adhocracy.tests.testtools import tt_get_instance, tt_make_user
 
 
 class TestEvent(TestController):
 
-    pass
+    def setUp(self):
+        super(TestEvent, self).setUp()
+        self.first = tt_make_user()
+        self.second = tt_make_user()
+
+    def test_batch_posts_one_message(self):
+        with patch.object(meta.Session, 'commit') as commit:
+            with patch.object(event.queue, 'has_queue', return_value=True):
+                with patch.object(event.queue, 'post_message') as post:
+                    with event.batch():
+                        first = event.emit(event.T_TEST, self.first,
+                                           instance=tt_get_instance())
+                        second = event.emit(event.T_TEST, self.second,
+                                            instance=tt_get_instance())
+                        self.assertFalse(post.called)
+        self.assertEqual(commit.call_count, 1)
+        post.assert_called_once_with(event.SERVICE,
+                                     '%s,%s' % (first.id, second.id))
+
+    def test_emit_many_processes_the_batch_without_queue(self):
+        with patch.object(meta.Session, 'commit'):
+            with patch.object(event.queue, 'has_queue', return_value=False):
+                with patch.object(event, 'process') as process:
+                    events = event.emit_many(
+                        event.T_TEST, [(self.first, {}), (self.second, {})],
+                        instance=tt_get_instance())
+        self.assertEqual([e.user for e in events], [self.first, self.second])
+        self.assertEqual([c[0][0] for c in process.call_args_list], events)
+
+    def test_handle_queue_message_loads_all_events(self):
+        with patch.object(meta.Session, 'commit'):
+            with patch.object(event.queue, 'has_queue', return_value=True):
+                with patch.object(event.queue, 'post_message') as post:
+                    events = event.emit_many(
+                        event.T_TEST, [(self.first, {}), (self.second, {})],
+                        instance=tt_get_instance())
+        with patch.object(event, 'process') as process:
+            event.handle_queue_message(post.call_args[0][1])
+        self.assertEqual([c[0][0] for c in process.call_args_list], events)
+        self.assertEqual(Event.find_all([e.id for e in events]), events)
@@ -4,6 +4,8 @@ from StringIO import StringIO
 from sunburnt.schema import SolrSchema
 from sunburnt.search import SolrSearch
 
+from adhocracy.tests import TestController
+
 
 # borrowed from sunburnt.test_search
 schema_string = \
@@ -63,3 +65,217 @@ class TestSolrSearch(TestCase):
         self.assertEqual(
             query.params(),
             [('q', '*:*')])
+
+
+class TestIndexWriter(TestCase):
+
+    def setUp(self):
+        from mock import Mock
+        from adhocracy.lib.search.index import IndexWriter
+        self.writer = IndexWriter(batch_size=3, flush_interval=10)
+        self.writer.connection = Mock()
+
+    def test_updates_are_buffered_until_batch_size(self):
+        self.writer.add({'id': 'a'})
+        self.writer.delete('b')
+        self.writer.flush()
+        self.assertFalse(self.writer.connection.add.called)
+        self.writer.add({'id': 'c'})
+        self.writer.flush()
+        (docs,), kwargs = self.writer.connection.add.call_args
+        self.assertEqual(sorted(doc['id'] for doc in docs), ['a', 'c'])
+        self.assertEqual(kwargs, {'commitWithin': 1000})
+        self.writer.connection.delete.assert_called_once_with(
+            ['b'], commitWithin=1000)
+        self.assertFalse(self.writer.connection.commit.called)
+        self.assertEqual(len(self.writer), 0)
+
+    def test_last_update_of_a_document_wins(self):
+        self.writer.add({'id': 'a'})
+        self.writer.delete('a')
+        self.writer.flush(force=True)
+        self.assertFalse(self.writer.connection.add.called)
+        self.writer.connection.delete.assert_called_once_with(
+            ['a'], commitWithin=1000)
+
+    def test_soft_commit_without_commit_within(self):
+        self.writer.commit_within = 0
+        self.writer.add({'id': 'a'})
+        self.writer.flush(force=True)
+        self.writer.connection.add.assert_called_once_with([{'id': 'a'}])
+        self.writer.connection.commit.assert_called_once_with(
+            softCommit=True)
+
+    def test_failed_batches_are_sent_again(self):
+        self.writer.connection.add.side_effect = IOError()
+        self.writer.add({'id': 'a'})
+        self.writer.flush(force=True)
+        self.assertEqual(len(self.writer), 1)
+        self.writer.connection.add.side_effect = None
+        self.writer.flush(force=True)
+        self.assertEqual(len(self.writer), 0)
+        self.assertEqual(self.writer.connection.add.call_count, 2)
+
+
+class TestIndexWriterEntities(TestController):
+
+    def test_failing_indexer_skips_only_its_entity(self):
+        from mock import Mock, patch
+        from adhocracy.lib.search import index
+        from adhocracy.tests.testtools import tt_make_user
+        users = [tt_make_user() for i in range(3)]
+        writer = index.IndexWriter(batch_size=10)
+        writer.connection = Mock()
+        for user in users:
+            writer.add_entity(user)
+        get_update_information = index.get_update_information
+
+        def failing(entity):
+            if entity.id == users[1].id:
+                raise ValueError(entity)
+            return get_update_information(entity)
+
+        with patch('adhocracy.lib.search.index.get_update_information',
+                   failing):
+            writer.flush(force=True)
+        (docs,), kwargs = writer.connection.add.call_args
+        self.assertEqual(set(doc['id'] for doc in docs),
+                         set([index.gen_id(users[0]),
+                              index.gen_id(users[2])]))
+        self.assertEqual(len(writer), 0)
+
+
+class TestConnectionPool(TestCase):
+
+    def setUp(self):
+        from adhocracy.lib.search.index import ConnectionPool
+        self.created = []
+        self.pool = ConnectionPool(self.factory, size=1)
+
+    def factory(self):
+        self.created.append(object())
+        return self.created[-1]
+
+    def test_released_connections_are_reused(self):
+        first = self.pool.acquire()
+        self.pool.release(first)
+        self.assertTrue(self.pool.acquire() is first)
+        self.assertEqual(len(self.created), 1)
+
+    def test_idle_connections_are_bounded(self):
+        first, second = self.pool.acquire(), self.pool.acquire()
+        self.assertFalse(first is second)
+        self.pool.release(first)
+        self.pool.release(second)
+        self.assertEqual(self.pool._idle, [first])
+
+
+class TestIndexFacts(TestController):
+
+    def test_facts_match_the_entities(self):
+        from adhocracy import model
+        from adhocracy.lib.search import facts
+        from adhocracy.tests.testtools import (tt_get_instance,
+                                               tt_make_proposal, tt_make_user)
+        user = tt_make_user()
+        commented = tt_make_proposal(creator=user)
+        model.Comment.create(u'text', user, commented)
+        model.Comment.create(u'more text', user, commented)
+        uncommented = tt_make_proposal(creator=user)
+        model.meta.Session.flush()
+
+        with facts.gathered([commented, uncommented, user]):
+            self.assertEqual(facts.comment_count(commented), 2)
+            self.assertEqual(facts.comment_count(uncommented), 0)
+            self.assertEqual(facts.user_activity(tt_get_instance(), user), 0)
+        self.assertEqual(facts.current(), None)
+        self.assertEqual(facts.comment_count(commented), 2)
+
+
+class TestDeltaReindex(TestController):
+
+    def test_only_changed_entities_are_selected(self):
+        from datetime import datetime, timedelta
+        from adhocracy import model
+        from adhocracy.lib import search
+        from adhocracy.tests.testtools import tt_make_proposal
+
+        def changed_ids(since):
+            return [id_ for (_, batch) in
+                    search._id_batches(model.Proposal, None, 100, since)
+                    for id_ in batch]
+
+        proposal = tt_make_proposal()
+        self.assertTrue(proposal.id in changed_ids(
+            proposal.create_time - timedelta(minutes=1)))
+        self.assertFalse(proposal.id in changed_ids(
+            datetime.utcnow() + timedelta(minutes=1)))
+
+
+class TestBuildDocs(TestController):
+
+    def test_only_newly_loaded_entities_are_expunged(self):
+        from adhocracy import model
+        from adhocracy.lib import search
+        from adhocracy.tests.testtools import tt_make_proposal
+        held = tt_make_proposal()
+        loaded = tt_make_proposal()
+        model.meta.Session.flush()
+        model.meta.Session.expunge(loaded)
+        docs = search.build_docs(('Proposal', [held.id, loaded.id]))
+        self.assertEqual(len(docs), 2)
+        self.assertTrue(held in model.meta.Session)
+        self.assertEqual(model.meta.Session.query(model.Proposal).get(
+            held.id), held)
+        self.assertFalse(any(isinstance(o, model.Proposal) and
+                             o.id == loaded.id
+                             for o in model.meta.Session))
+
+
+class TestLocalSearch(TestCase):
+
+    def setUp(self):
+        from adhocracy.lib.search.local import LocalSearchInterface
+        self.search = LocalSearchInterface(':memory:')
+        self.search.add([
+            {'id': '1', 'ref': '@[proposal:1]', 'doc_type': 'proposal',
+             'title': u'Free Parking', 'tag': [u'traffic'],
+             'facet.badges': [1, 2], 'order.proposal.support': 3},
+            {'id': '2', 'ref': '@[proposal:2]', 'doc_type': 'proposal',
+             'title': u'More parks', 'body': u'Green spaces',
+             'facet.badges': [2], 'order.proposal.support': 5},
+            {'id': '3', 'ref': '@[user:3]', 'doc_type': 'user',
+             'title': u'Parker'}])
+
+    def refs(self, query):
+        return [doc['ref'] for doc in query.execute().result.docs]
+
+    def test_wildcard_query(self):
+        from adhocracy.lib.search.query import add_wildcard_query
+        query = self.search.query().filter(doc_type='proposal')
+        self.assertEqual(self.refs(add_wildcard_query(query, 'text', 'PARK')),
+                         ['@[proposal:1]', '@[proposal:2]'])
+        self.assertEqual(self.refs(add_wildcard_query(query, 'text',
+                                                      'park green')),
+                         ['@[proposal:2]'])
+
+    def test_sort_and_paginate(self):
+        query = self.search.query(doc_type='proposal')
+        query = query.sort_by('-order.proposal.support').paginate(rows=1)
+        response = query.execute()
+        self.assertEqual(response.result.numFound, 2)
+        self.assertEqual([doc['ref'] for doc in response.result.docs],
+                         ['@[proposal:2]'])
+
+    def test_facets(self):
+        query = self.search.query(doc_type='proposal')
+        query = query.facet_by('facet.badges').query(**{'facet.badges': 1})
+        response = query.execute()
+        self.assertEqual(response.result.numFound, 1)
+        self.assertEqual(dict(response.facet_counts.facet_fields[
+            'facet.badges']), {u'1': 1, u'2': 1})
+
+    def test_delete_by_query(self):
+        self.search.delete(queries=self.search.query(doc_type='user'))
+        self.search.delete('1')
+        self.assertEqual(self.refs(self.search.query()), ['@[proposal:2]'])
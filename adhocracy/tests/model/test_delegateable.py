@@ -0,0 +1,45 @@
+from adhocracy.model import Page, Poll
+
+from adhocracy.tests import TestController
+from adhocracy.tests.testtools import (tt_get_instance, tt_make_proposal,
+                                       tt_make_str, tt_make_user)
+
+
+class TestScopeHierarchy(TestController):
+
+    def setUp(self):
+        super(TestScopeHierarchy, self).setUp()
+        self.creator = tt_make_user()
+        self.proposal = tt_make_proposal(creator=self.creator)
+        self.page = self._make_page()
+        self.subpage = self._make_page()
+        self.page.parents.append(self.proposal)
+        self.subpage.parents.append(self.page)
+
+    def _make_page(self):
+        return Page.create(tt_get_instance(), tt_make_str(), tt_make_str(),
+                           self.creator)
+
+    def test_descendant_ids(self):
+        self.assertEqual(self.proposal.descendant_ids(),
+                         set([self.page.id, self.subpage.id]))
+        self.assertEqual(self.subpage.descendant_ids(), set())
+
+    def test_is_super_and_is_sub(self):
+        self.assertTrue(self.proposal.is_super(self.subpage))
+        self.assertTrue(self.page.is_super(self.subpage))
+        self.assertFalse(self.subpage.is_super(self.proposal))
+        self.assertTrue(self.subpage.is_sub(self.proposal))
+        self.assertFalse(self.proposal.is_super(self.proposal))
+
+    def test_within_scope_includes_descendants(self):
+        poll = Poll.create(self.subpage, self.creator, Poll.RATE)
+        self.assertTrue(poll in Poll.within_scope(self.proposal))
+        self.assertFalse(poll in Poll.within_scope(tt_make_proposal()))
+
+    def test_scope_index_is_dropped_when_the_graph_changes(self):
+        self.assertEqual(self.proposal.descendant_ids(),
+                         set([self.page.id, self.subpage.id]))
+        other = self._make_page()
+        other.parents.append(self.subpage)
+        self.assertTrue(self.proposal.is_super(other))
@@ -0,0 +1,143 @@
+from datetime import timedelta
+
+from mock import patch
+
+from adhocracy import model
+from adhocracy.lib.democracy import Decision
+from adhocracy.model import Delegation, Poll, Tally, Vote
+
+from adhocracy.tests import TestController
+from adhocracy.tests.testtools import tt_make_proposal, tt_make_user
+
+
+class TallyTestCase(TestController):
+
+    def setUp(self):
+        super(TallyTestCase, self).setUp()
+        self.proposal = tt_make_proposal(voting=True)
+        self.poll = Poll.create(self.proposal, self.proposal.creator,
+                                Poll.ADOPT)
+        self.start = self.poll.tallies[0].create_time
+        self.minutes = 0
+
+    def _vote(self, user, orientation, delegation=None):
+        self.minutes += 1
+        vote = Vote(user, self.poll, orientation, delegation=delegation)
+        vote.create_time = self.start + timedelta(minutes=self.minutes)
+        model.meta.Session.add(vote)
+        model.meta.Session.flush()
+        return vote
+
+    def _counts(self, tally):
+        return (tally.num_for, tally.num_against, tally.num_abstain)
+
+
+class TestIncrementalTally(TallyTestCase):
+
+    def _assert_matches_recount(self, vote):
+        tally = Tally.create_incremental(vote)
+        self.assertNotEqual(tally, None)
+        tally.vote = vote
+        recount = Tally.create_from_poll(self.poll, vote.create_time)
+        self.assertEqual(self._counts(tally), self._counts(recount))
+        model.meta.Session.delete(recount)
+        model.meta.Session.flush()
+        return tally
+
+    def test_applies_new_and_changed_votes(self):
+        first = tt_make_user()
+        second = tt_make_user()
+        tally = self._assert_matches_recount(self._vote(first, Vote.YES))
+        self.assertEqual(self._counts(tally), (1, 0, 0))
+        tally = self._assert_matches_recount(self._vote(second, Vote.NO))
+        self.assertEqual(self._counts(tally), (1, 1, 0))
+        tally = self._assert_matches_recount(self._vote(first, Vote.ABSTAIN))
+        self.assertEqual(self._counts(tally), (0, 1, 1))
+
+    def test_applies_delegated_votes(self):
+        principal = tt_make_user()
+        agent = tt_make_user()
+        delegation = Delegation.create(principal, agent, self.proposal,
+                                       replay=False)
+        self._assert_matches_recount(self._vote(agent, Vote.YES))
+        tally = self._assert_matches_recount(
+            self._vote(principal, Vote.YES, delegation=delegation))
+        self.assertEqual(self._counts(tally), (2, 0, 0))
+        tally = self._assert_matches_recount(self._vote(principal, Vote.NO))
+        self.assertEqual(self._counts(tally), (1, 1, 0))
+
+    def test_falls_back_if_votes_are_missing_from_the_previous_tally(self):
+        first = tt_make_user()
+        self._vote(first, Vote.YES)
+        vote = self._vote(tt_make_user(), Vote.NO)
+        self.assertEqual(Tally.create_incremental(vote), None)
+        tally = Tally.create_from_vote(vote, incremental=True)
+        self.assertEqual(self._counts(tally), (1, 1, 0))
+        self.assertEqual(tally.vote, vote)
+
+    def test_applies_bulk_propagation_as_one_step(self):
+        agent = tt_make_user()
+        principals = [tt_make_user() for i in range(3)]
+        for principal in principals:
+            Delegation.create(principal, agent, self.proposal, replay=False)
+        records = Decision(agent, self.poll).make(Vote.YES, bulk=True)
+        self.assertEqual(len(records), 4)
+        with patch.object(Tally, 'create_from_poll') as create_from_poll:
+            for record in records:
+                vote = Vote.find(record.id, instance_filter=False)
+                tally = Tally.create_from_vote(vote, incremental=True)
+                self.assertEqual(self._counts(tally), (4, 0, 0))
+        self.assertFalse(create_from_poll.called)
+        recount = Tally.create_from_poll(self.poll, records[0].create_time)
+        self.assertEqual(self._counts(recount), (4, 0, 0))
+
+
+class TestTallyReplay(TallyTestCase):
+
+    def test_replay_matches_recount_at_every_vote(self):
+        principal = tt_make_user()
+        agent = tt_make_user()
+        delegation = Delegation.create(principal, agent, self.proposal,
+                                       replay=False)
+        self._vote(agent, Vote.YES)
+        self._vote(principal, Vote.YES, delegation=delegation)
+        self._vote(tt_make_user(), Vote.NO)
+        self._vote(principal, Vote.ABSTAIN)
+        samples = list(Tally.replay(self.poll))
+        self.assertEqual(len(samples), 4)
+        for sample in samples:
+            recount = Tally.create_from_poll(self.poll, sample.create_time)
+            self.assertEqual(self._counts(sample), self._counts(recount))
+        self.assertEqual(self._counts(samples[-1]), (1, 1, 1))
+
+    def test_replay_in_intervals(self):
+        first = self._vote(tt_make_user(), Vote.YES)
+        self._vote(tt_make_user(), Vote.NO)
+        end_time = first.create_time + timedelta(minutes=2)
+        samples = list(Tally.replay(self.poll, interval=timedelta(minutes=1),
+                                    end_time=end_time))
+        self.assertTrue(all(s.vote_id is None for s in samples))
+        self.assertTrue(end_time - timedelta(minutes=1) <
+                        samples[-1].create_time <= end_time)
+        self.assertEqual(self._counts(samples[-1]), (1, 1, 0))
+        self.assertEqual(self._counts(samples[0]), (0, 0, 0))
+
+    def test_backfill_creates_missing_tallies(self):
+        first = self._vote(tt_make_user(), Vote.YES)
+        second = self._vote(tt_make_user(), Vote.YES)
+        Tally.create_from_vote(first)
+        self.assertEqual(Tally.backfill(self.poll), 1)
+        self.assertEqual(self._counts(Tally.find_by_vote(second)), (2, 0, 0))
+        self.assertEqual(Tally.backfill(self.poll, replace=True), 0)
+
+    def test_backfill_instance_covers_all_polls(self):
+        first = self._vote(tt_make_user(), Vote.YES)
+        other = Poll.create(self.proposal, self.proposal.creator, Poll.RATE)
+        second = Vote(tt_make_user(), other, Vote.NO)
+        model.meta.Session.add(second)
+        model.meta.Session.flush()
+        changed = list(Tally.backfill_instance(self.proposal.instance,
+                                               batch_size=1))
+        self.assertTrue(sum(changed) >= 2)
+        self.assertEqual(self._counts(Tally.find_by_vote(first)), (1, 0, 0))
+        self.assertEqual(self._counts(Tally.find_by_vote(second)), (0, 1, 0))
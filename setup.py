@@ -92,7 +92,8 @@ setup(
         ],
         'paste.paster_command': [
             'background = adhocracy.lib.cli:Background',
-            'index = adhocracy.lib.cli:Index'
+            'index = adhocracy.lib.cli:Index',
+            'tallies = adhocracy.lib.cli:Tallies'
         ],
         'paste.app_install': [
             'main = pylons.util:PylonsInstaller'